@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Measures the wall time of ``bob_dbmanage.py msu_mfsd_mod dumplist``, from
+interpreter start to exit, against a startup budget."""
+
+import subprocess
+import sys
+import time
+
+from common import argument_parser, report
+
+
+BUDGET_SECONDS = 1.0
+"""The startup budget of a dumplist call (median over the repetitions)"""
+
+CODE = '''
+import sys
+from bob.db.base.script.dbmanage import main
+sys.exit(main(%r))
+'''
+
+
+def run_once(command):
+  """Runs one CLI command in a new interpreter, returns its wall time"""
+  start = time.perf_counter()
+  subprocess.check_call([sys.executable, '-c', CODE % (command,)],
+                        stdout=subprocess.DEVNULL)
+  return time.perf_counter() - start
+
+
+def run(repeat, budget=BUDGET_SECONDS):
+  results = {}
+  for name, command in (
+      ('dumplist', ['msu_mfsd_mod', 'dumplist']),
+      ('dumplist_filtered', ['msu_mfsd_mod', 'dumplist', '-g', 'train',
+                             '-c', 'real']),
+      ('help', ['msu_mfsd_mod', '--help']),
+  ):
+    timings = sorted(run_once(command) for _ in range(repeat))
+    median = timings[len(timings) // 2]
+    results[name] = {
+        'min': timings[0],
+        'median': median,
+        'max': timings[-1],
+        'repeat': repeat,
+        'budget': budget,
+        'within_budget': median <= budget,
+    }
+  return results
+
+
+if __name__ == '__main__':
+  parser = argument_parser(__doc__)
+  parser.add_argument('--budget', type=float, default=BUDGET_SECONDS,
+                      help="The startup budget, in seconds (defaults to %(default)s)")
+  parser.add_argument('--check', action='store_true',
+                      help="Exit with an error if a command is over budget")
+  args = parser.parse_args()
+  results = run(args.repeat, args.budget)
+  report('cli_startup', results, args.output)
+  if args.check and not all(r['within_budget'] for r in results.values()):
+    sys.exit(1)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Helpers shared by the benchmarks: timing and JSON reporting.
+
+Every benchmark is a script that accepts ``--repeat`` and ``--output`` and
+writes its results as a JSON document, so that runs can be compared over time.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+
+def measure(func, repeat=5, number=1):
+  """Times ``func()``, returning statistics in seconds per call.
+
+  ``func`` is called ``number`` times in a row, and this is repeated
+  ``repeat`` times. The minimum is the most stable estimate.
+  """
+
+  timings = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    for _ in range(number):
+      func()
+    timings.append((time.perf_counter() - start) / number)
+  timings.sort()
+  return {
+      'min': timings[0],
+      'median': timings[len(timings) // 2],
+      'max': timings[-1],
+      'repeat': repeat,
+      'number': number,
+  }
+
+
+def argument_parser(description, repeat=5):
+  """Returns a parser with the options common to all benchmarks"""
+
+  parser = argparse.ArgumentParser(description=description)
+  parser.add_argument('-r', '--repeat', type=int, default=repeat,
+                      help="How many times each measurement is repeated (defaults to %(default)s)")
+  parser.add_argument('-o', '--output', default=None,
+                      help="Write the JSON results to this file instead of the standard output")
+  return parser
+
+
+def report(name, results, output=None):
+  """Writes the results of a benchmark as JSON"""
+
+  document = {
+      'benchmark': name,
+      'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'python': platform.python_version(),
+      'platform': platform.platform(),
+      'results': results,
+  }
+  if output is None:
+    json.dump(document, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+  else:
+    with open(output, 'wt') as f:
+      json.dump(document, f, indent=2, sort_keys=True)
+  return document
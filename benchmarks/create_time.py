@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Measures the time needed to rebuild the SQLite database with the
+``create`` command, into a temporary file."""
+
+import argparse
+import os
+import shutil
+import tempfile
+
+from common import argument_parser, measure, report
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+"""The root of the source tree; ``create`` reads its lists relative to it"""
+
+
+def run(repeat):
+  from bob.db.msu_mfsd_mod.create import create
+
+  tmpdir = tempfile.mkdtemp()
+  cwd = os.getcwd()
+  try:
+    os.chdir(ROOT)
+    args = argparse.Namespace(recreate=True, verbose=0, type='sqlite', directory=None,
+                              files=[os.path.join(tmpdir, 'db.sql3')])
+    return {'create': measure(lambda: create(args), repeat=repeat)}
+  finally:
+    os.chdir(cwd)
+    shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+  args = argument_parser(__doc__).parse_args()
+  report('create_time', run(args.repeat), args.output)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Measures the time needed to import bob.db.msu_mfsd_mod in a fresh
+interpreter, and which heavy dependencies get imported with it."""
+
+import json
+import subprocess
+import sys
+
+from common import argument_parser, report
+
+
+HEAVY_MODULES = ('bob.io.video', 'bob.io.base', 'bob.core', 'pkg_resources',
+                 'sqlalchemy', 'numpy')
+"""Modules whose import is tracked"""
+
+CODE = '''
+import json, sys, time
+start = time.perf_counter()
+import bob.db.msu_mfsd_mod
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds,
+                  'imported': [m for m in %r if m in sys.modules]}))
+''' % (HEAVY_MODULES,)
+
+
+def import_once():
+  """Imports the package in a new interpreter"""
+  output = subprocess.check_output([sys.executable, '-c', CODE])
+  return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def run(repeat):
+  runs = [import_once() for _ in range(repeat)]
+  timings = sorted(r['seconds'] for r in runs)
+  return {
+      'import': {
+          'min': timings[0],
+          'median': timings[len(timings) // 2],
+          'max': timings[-1],
+          'repeat': repeat,
+      },
+      'imported_modules': runs[-1]['imported'],
+  }
+
+
+if __name__ == '__main__':
+  args = argument_parser(__doc__, repeat=10).parse_args()
+  report('import_time', run(args.repeat), args.output)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Measures the throughput of ``File.load()``, ``File.iter_frames()``,
+``File.load_faces()`` and ``File.bbx()`` on synthetic videos and face files
+written at the paths of a few files of the database."""
+
+from common import argument_parser, measure, report
+from synthetic import (FRAMES, temporary_database, temporary_directory,
+                       write_faces, write_videos)
+
+
+def throughput(timing, frames):
+  """Adds the number of frames per second to a timing"""
+  timing['frames_per_second'] = frames / timing['min']
+  return timing
+
+
+def run(repeat, videos=4, frames=FRAMES):
+  from bob.db.msu_mfsd_mod import Database
+  from bob.db.msu_mfsd_mod import faceindex
+
+  results = {}
+  with temporary_directory() as tmpdir:
+    with temporary_database(tmpdir):
+      db = Database()
+      # both qualities, and rotated videos if any
+      files = (db.objects(quality='laptop')[:videos // 2] +
+               db.objects(quality='mobile')[:videos - videos // 2])
+      write_videos(files, tmpdir, frames)
+      write_faces(files, tmpdir, frames)
+      total = len(files) * frames
+
+      def load(**kwargs):
+        for f in files:
+          f.load(tmpdir, **kwargs)
+
+      results['load'] = throughput(measure(load, repeat), total)
+      results['load_contiguous_float32'] = throughput(measure(
+          lambda: load(contiguous=True, dtype='float32'), repeat), total)
+      results['load_first_frame'] = throughput(measure(
+          lambda: load(frames=[0]), repeat), len(files))
+
+      def iterate():
+        for f in files:
+          for _ in f.iter_frames(tmpdir):
+            pass
+
+      results['iter_frames'] = throughput(measure(iterate, repeat), total)
+      results['load_faces'] = throughput(measure(
+          lambda: [f.load_faces(tmpdir, bbx_directory=tmpdir) for f in files],
+          repeat), total)
+
+      results['bbx_parse'] = measure(
+          lambda: [f.bbx(tmpdir) for f in files], repeat, 10)
+      results['bbx_cached'] = measure(
+          lambda: [f.bbx(tmpdir, cache=True) for f in files], repeat, 10)
+      faceindex.build(files, tmpdir)
+      results['bbx_index'] = measure(
+          lambda: [f.bbx(tmpdir) for f in files], repeat, 10)
+      results['videos'] = len(files)
+      results['frames_per_video'] = frames
+  return results
+
+
+if __name__ == '__main__':
+  parser = argument_parser(__doc__)
+  parser.add_argument('--videos', type=int, default=4,
+                      help="The number of synthetic videos (defaults to %(default)s)")
+  parser.add_argument('--frames', type=int, default=FRAMES,
+                      help="The number of frames per video (defaults to %(default)s)")
+  args = parser.parse_args()
+  report('load_throughput', run(args.repeat, args.videos, args.frames),
+         args.output)
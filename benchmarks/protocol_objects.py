@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Measures the latency of the verification protocol queries, for every
+protocol, group and purpose, on a freshly built copy of the database."""
+
+from common import argument_parser, measure, report
+from synthetic import temporary_database, temporary_directory
+
+
+def run(repeat):
+  from bob.db.msu_mfsd_mod import VerificationDatabase
+
+  results = {}
+  with temporary_directory() as tmpdir:
+    with temporary_database(tmpdir):
+      db = VerificationDatabase()
+      for protocol in db.protocol_names():
+        for group in db.groups():
+          for purpose in ('enroll', 'probe'):
+            query = dict(protocol=protocol, groups=group, purposes=purpose)
+            # a new database every time: no cached queries nor samples
+            cold = measure(lambda: VerificationDatabase().objects(**query),
+                           repeat)
+            db.objects(**query)
+            warm = measure(lambda: db.objects(**query), repeat)
+            name = '%s/%s/%s' % (protocol, group, purpose)
+            results[name] = {'cold': cold, 'warm': warm,
+                             'samples': len(db.objects(**query))}
+        results['%s/model_ids' % protocol] = measure(
+            lambda: db.model_ids_with_protocol(protocol=protocol), repeat)
+  return results
+
+
+if __name__ == '__main__':
+  args = argument_parser(__doc__).parse_args()
+  report('protocol_objects', run(args.repeat), args.output)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Measures the latency of ``Database.objects()`` for combinations of
+filters, on a freshly built copy of the database, with and without the query
+cache and the in-memory index."""
+
+from common import argument_parser, measure, report
+from synthetic import temporary_database, temporary_directory
+
+
+FILTERS = (
+    ('all', {}),
+    ('group', {'group': 'train'}),
+    ('cls', {'cls': 'real'}),
+    ('quality', {'quality': 'mobile'}),
+    ('instrument', {'instrument': 'print', 'cls': 'attack'}),
+    ('fold', {'fold': 'fold3', 'group': 'test'}),
+    ('ids', {'ids': ['01', '21', '55']}),
+    ('combined', {'group': ('train', 'devel'), 'cls': 'attack',
+                  'quality': 'laptop', 'instrument': ('video_hd', 'print')}),
+)
+"""The filter combinations, by name"""
+
+MODES = (
+    ('sql', {}),
+    ('cached', {'cache_queries': True}),
+    ('in_memory', {'in_memory': True}),
+)
+"""The configurations of the database, by name"""
+
+
+def run(repeat, number=10):
+  from bob.db.msu_mfsd_mod import Database
+
+  results = {}
+  with temporary_directory() as tmpdir:
+    with temporary_database(tmpdir):
+      for mode, options in MODES:
+        db = Database(**options)
+        for name, kwargs in FILTERS:
+          db.objects(**kwargs)  # warm up the session, caches and indices
+          timing = measure(lambda: db.objects(**kwargs), repeat, number)
+          timing['files'] = len(db.objects(**kwargs))
+          results['%s/%s' % (mode, name)] = timing
+  return results
+
+
+if __name__ == '__main__':
+  parser = argument_parser(__doc__)
+  parser.add_argument('-n', '--number', type=int, default=10,
+                      help="How many queries are timed together (defaults to %(default)s)")
+  args = parser.parse_args()
+  report('query_latency', run(args.repeat, args.number), args.output)
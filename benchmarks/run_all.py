@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Runs all benchmarks and writes their results as a single JSON document.
+
+Compare the documents of two runs to detect performance regressions, e.g. of
+the main branch and of a merge request.
+"""
+
+import importlib
+import traceback
+
+from common import argument_parser, report
+
+
+BENCHMARKS = ('import_time', 'cli_startup', 'create_time', 'query_latency',
+              'protocol_objects', 'load_throughput')
+"""The modules of the benchmarks, in the order they are run"""
+
+
+def run(repeat, names=BENCHMARKS):
+  results = {}
+  for name in names:
+    module = importlib.import_module(name)
+    try:
+      results[name] = module.run(repeat)
+    except Exception:
+      # e.g. bob.io.video cannot write synthetic videos on this machine
+      results[name] = {'error': traceback.format_exc()}
+  return results
+
+
+if __name__ == '__main__':
+  parser = argument_parser(__doc__, repeat=3)
+  parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                      help="The benchmarks to run, among %s (defaults to all)" % (', '.join(BENCHMARKS),))
+  args = parser.parse_args()
+  unknown = sorted(set(args.benchmarks) - set(BENCHMARKS))
+  if unknown:
+    parser.error('unknown benchmarks: %s' % ', '.join(unknown))
+  report('all', run(args.repeat, args.benchmarks or BENCHMARKS), args.output)
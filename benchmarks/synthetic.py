@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Synthetic data for the benchmarks, generated locally.
+
+The benchmarks do not need the MSU-MFSD videos: :py:func:`write_videos` and
+:py:func:`write_faces` create short videos and ``.face`` files, with the
+resolutions of the real ones, at the paths of the database files.
+:py:func:`temporary_database` rebuilds the SQLite file of the package into a
+temporary directory and points :py:mod:`bob.db.msu_mfsd_mod.query` to it.
+"""
+
+import argparse
+import contextlib
+import os
+import shutil
+import tempfile
+
+import numpy
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+"""The root of the source tree; ``create`` reads its lists relative to it"""
+
+FRAMES = 30
+"""The default number of frames of the synthetic videos"""
+
+
+@contextlib.contextmanager
+def temporary_directory():
+  """Yields a temporary directory, removed on exit"""
+  tmpdir = tempfile.mkdtemp(prefix='msu_mfsd_mod_bench_')
+  try:
+    yield tmpdir
+  finally:
+    shutil.rmtree(tmpdir)
+
+
+@contextlib.contextmanager
+def temporary_database(tmpdir):
+  """Builds the database into ``tmpdir`` and makes it the one opened by
+  :py:class:`bob.db.msu_mfsd_mod.Database`, until the context is left"""
+  from bob.db.msu_mfsd_mod import query
+  from bob.db.msu_mfsd_mod.create import create
+
+  filename = os.path.join(tmpdir, 'db.sql3')
+  cwd = os.getcwd()
+  try:
+    os.chdir(ROOT)
+    create(argparse.Namespace(recreate=True, verbose=0, type='sqlite',
+                              directory=None, files=[filename]))
+  finally:
+    os.chdir(cwd)
+
+  original = query.SQLITE_FILE
+  query.SQLITE_FILE = filename
+  try:
+    yield filename
+  finally:
+    query.SQLITE_FILE = original
+
+
+def frames_for(f, frames=FRAMES, seed=0):
+  """Returns random ``(frames, 3, height, width)`` frames with the
+  resolution of the videos of ``f``"""
+  shape = f.frame_shapes[f.get_quality()]
+  generator = numpy.random.RandomState(seed + f.id)
+  return generator.randint(0, 256, size=(frames,) + shape).astype(numpy.uint8)
+
+
+def write_videos(files, directory, frames=FRAMES):
+  """Writes a synthetic video for each file, at the path of its video"""
+  import bob.io.base
+  import bob.io.video
+
+  for f in files:
+    path = f.videofile(directory)
+    bob.io.base.create_directories_safe(os.path.dirname(path))
+    data = frames_for(f, frames)
+    writer = bob.io.video.writer(path, data.shape[2], data.shape[3])
+    for frame in data:
+      writer.append(frame)
+    writer.close()
+
+
+def write_faces(files, directory, frames=FRAMES):
+  """Writes a synthetic ``.face`` file for each file, with one face per
+  frame in the ``frame,x1,y1,x2,y2`` format of the database"""
+  for f in files:
+    path = f.facefile(directory)
+    if not os.path.exists(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    _, height, width = f.frame_shapes[f.get_quality()]
+    with open(path, 'wt') as out:
+      for k in range(frames):
+        x, y = width // 4 + k % 8, height // 4 + k % 8
+        out.write('%d,%d,%d,%d,%d\n' % (k, x, y, x + width // 2, y + height // 2))
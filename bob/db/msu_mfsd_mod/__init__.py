@@ -9,6 +9,8 @@
 from .query import Database
 from .verificationprotocol import Database as VerificationDatabase, File as VerificationFile
 from .models import Client, File
+from .cache import VideoCache
+from .framestore import FrameStore
 
 def get_config():
   """Returns a string containing the configuration information.
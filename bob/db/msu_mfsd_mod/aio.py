@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""An :py:mod:`asyncio` interface to the database.
+
+Queries and decoding block for a long time, so :py:class:`AsyncDatabase` runs
+them on executors and returns awaitables instead: all SQLite access happens
+in one dedicated thread (SQLite connections must not be shared between
+threads), and videos are decoded in a bounded thread pool::
+
+  async with AsyncDatabase(max_concurrency=4) as db:
+      files = await db.objects(group='test')
+      async for f, video in db.prefetch(files, directory):
+          score(f, video)  # the next videos are decoded meanwhile
+
+Cancelling a load frees its concurrency slot at once, but a decode that
+already started runs to completion in its thread, as threads cannot be
+interrupted.
+
+This module requires Python 3.6 or later, and is not imported by the rest of
+the package: import it explicitly.
+"""
+
+import asyncio
+import collections
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+
+# asyncio.get_running_loop() is new in Python 3.7; within a coroutine,
+# get_event_loop() returns the same loop on Python 3.6
+_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+async def load(file, directory=None, extension=None, executor=None, **kwargs):
+    """Asynchronous :py:meth:`.File.load`.
+
+    The file is loaded in ``executor`` (a
+    :py:class:`concurrent.futures.Executor`, defaults to the one of the event
+    loop), so the event loop is not blocked while the video is decoded. Use
+    :py:class:`AsyncDatabase` to also bound the number of concurrent loads.
+
+    All other parameters are passed to ``file.load()``.
+    """
+    return await _running_loop().run_in_executor(executor, functools.partial(
+        file.load, directory, extension, **kwargs))
+
+
+class AsyncDatabase(object):
+    """Asynchronous queries and loads on :py:class:`.Database`.
+
+    Parameters:
+
+      workers (int): The number of decoding threads. Defaults to the number
+        of CPUs.
+
+      max_concurrency (int): The maximum number of loads running or waiting
+        for a decoding thread at any time. Defaults to ``workers``.
+
+      kwargs: Passed to the constructor of :py:class:`.Database`, which runs
+        in the SQLite thread.
+    """
+
+    def __init__(self, workers=None, max_concurrency=None, **kwargs):
+        if workers is None:
+            import multiprocessing
+            workers = multiprocessing.cpu_count()
+        self.workers = workers
+        self.max_concurrency = max_concurrency or workers
+        self._kwargs = kwargs
+        self._database = None
+        self._sqlite = ThreadPoolExecutor(max_workers=1)
+        self._decoder = ThreadPoolExecutor(max_workers=workers)
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Shuts the executors down, without waiting for running decodes"""
+        self._sqlite.shutdown(wait=False)
+        self._decoder.shutdown(wait=False)
+
+    def _call(self, method, *args, **kwargs):
+        """Calls a method of the database; runs in the SQLite thread"""
+        if self._database is None:
+            from .query import Database
+            self._database = Database(**self._kwargs)
+        return getattr(self._database, method)(*args, **kwargs)
+
+    async def query(self, method, *args, **kwargs):
+        """Runs any method of :py:class:`.Database` in the SQLite thread"""
+        return await _running_loop().run_in_executor(
+            self._sqlite, functools.partial(self._call, method, *args,
+                                            **kwargs))
+
+    async def objects(self, **kwargs):
+        """Asynchronous :py:meth:`.Database.objects`"""
+        return await self.query('objects', **kwargs)
+
+    async def load(self, file, directory=None, extension=None, **kwargs):
+        """Loads a file (any object with a ``load()`` method, e.g. a
+        :py:class:`.File` or a :py:class:`.VerificationFile`) in a decoding
+        thread, once fewer than ``max_concurrency`` loads are running"""
+        if self._semaphore is None:
+            # created here, so that it belongs to the running event loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            return await load(file, directory, extension, self._decoder,
+                              **kwargs)
+
+    async def prefetch(self, files, directory=None, extension=None,
+                       depth=None, **kwargs):
+        """Loads files ahead of their consumer.
+
+        Yields ``(file, data)`` tuples in the order of ``files``, while the
+        next ``depth`` files (defaults to ``max_concurrency``) are already
+        being loaded. Closing the generator with ``aclose()`` cancels the
+        pending loads; as Python does not close asynchronous generators when
+        an ``async for`` loop is left early, do it explicitly in that case,
+        e.g. in a ``try``/``finally`` block.
+        """
+        depth = depth or self.max_concurrency
+        remaining = iter(files)
+        pending = collections.deque()
+
+        def submit(n):
+            for f in itertools.islice(remaining, n):
+                pending.append((f, asyncio.ensure_future(
+                    self.load(f, directory, extension, **kwargs))))
+
+        try:
+            submit(depth)
+            while pending:
+                f, task = pending.popleft()
+                data = await task
+                submit(1)
+                yield f, data
+        finally:
+            for _, task in pending:
+                task.cancel()
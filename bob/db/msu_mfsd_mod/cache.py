@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""A size-bounded, least-recently-used cache for decoded videos.
+
+The verification protocol fans every video out into several frame samples.
+Keeping the decoded video around lets sibling samples share a single decode.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+"""Default memory budget of the video cache (512 MiB, enough for a couple of
+decoded MSU-MFSD videos)"""
+
+
+class VideoCache(object):
+    """Keeps recently decoded videos in memory, up to a byte budget.
+
+    Entries are evicted in least-recently-used order as soon as the total size
+    of the cached arrays exceeds ``max_bytes``. Arrays larger than the budget
+    are returned but never cached. All methods are thread-safe.
+
+    Parameters:
+
+      max_bytes (int): The memory budget of the cache, in bytes. Set it to
+        ``0`` to disable caching.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """Returns the cached array for ``key`` or ``None`` if not cached."""
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            # reinserted as the most recently used entry (Python 2 has no
+            # OrderedDict.move_to_end)
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Stores ``value`` under ``key``, evicting older entries if needed."""
+        size = getattr(value, 'nbytes', 0)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._entries[key] = value
+            self.nbytes += size
+            self._evict()
+
+    def get_or_load(self, key, loader):
+        """Returns the cached array for ``key``, calling ``loader()`` and
+        caching its result on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            self.put(key, value)
+        return value
+
+    def resize(self, max_bytes):
+        """Changes the memory budget, evicting entries if needed."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        """Drops all cached entries and resets the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        """Returns a dictionary with the hit/miss counters and the current
+        occupancy of the cache."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and self._entries:
+            _, value = self._entries.popitem(last=False)
+            self.nbytes -= value.nbytes
+            self.evictions += 1
+
+
+video_cache = VideoCache()
+"""The video cache shared by all :py:class:`.VerificationFile` samples"""
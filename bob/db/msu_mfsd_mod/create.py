@@ -131,62 +131,77 @@ def add_clients(session, protocol_list, verbose=False):
   assert len(protocol_list)==5, "add_clients():: input protocol_list should have exactly 5 items"
   #1. construct list of client_nums from dictionary
   clientList = list(protocol_list[0].keys())
-  
-  #for each client, make one entry in the Client table.
+
+  #for each client, make one row for the Client table; all rows are inserted in one go.
+  rows = []
   for cId in clientList:
-    fold1Group = protocol_list[0][cId]
-    fold2Group = protocol_list[1][cId]
-    fold3Group = protocol_list[2][cId]
-    fold4Group = protocol_list[3][cId]
-    fold5Group = protocol_list[4][cId]
-#    print("%s %s %s %s %s" %(fold1Group,fold2Group,fold3Group,fold4Group,fold5Group))
+    rows.append({
+      'id': cId,
+      'client_fold1': protocol_list[0][cId],
+      'client_fold2': protocol_list[1][cId],
+      'client_fold3': protocol_list[2][cId],
+      'client_fold4': protocol_list[3][cId],
+      'client_fold5': protocol_list[4][cId],
+      })
+
+  session.execute(Client.__table__.insert(), rows)
+  if verbose: print("%d clients added to db" %(len(rows)))
+
 
-#    clientNumStr = str(cId).zfill(3)
-    session.add(Client(cId, fold1Group, fold2Group, fold3Group, fold4Group, fold5Group))
+def count_frames(directory, file_stem, quality):
+  """Returns the number of frames of a video, as announced by the header of its container (the video is not decoded)"""
+  import bob.io.video
+  extension = '.mov' if quality == 'laptop' else '.mp4'
+  return bob.io.video.reader(os.path.join(directory, file_stem + extension)).number_of_frames
 
 
-    	
-def add_files(session, real_fileList, attack_fileList, verbose=False):
+def add_files(session, real_fileList, attack_fileList, verbose=False, directory=None):
   """Reads the 2 input files (real_fileList, attackFileList), and for each line in each file, adds a row in the File table
      Inputs:
      session: the db session
      real_fileList: text-file containing names of all video-files of real-presentations (1 filename per line)
      attack_fileList: text-file containing names of all video-files of attack-presentations (1 filename per line)
+     directory: if given, the directory of the original videos, from which the number of frames of each video is read
   """
   #load list of files that should be rotated
-  rotFile = 'bob/db/msu_mfsd_mod/rotated_videos/rotated_videos.txt'  
+  rotFile = 'bob/db/msu_mfsd_mod/rotated_videos/rotated_videos.txt'
   rotFile = os.path.join(os.getcwd(), rotFile)
   if verbose: print("Rotation file: %s" %(rotFile))
 
-
-  rotate_list= []  #read the rotFile and append filenames of files to be rotated to this list
+  rotate_set = set() #read the rotFile and add filenames of files to be rotated to this set
   for fn in open(rotFile, 'rt'):
-    rotate_list.append(fn.strip())
+    rotate_set.add(fn.strip())
+
+  if verbose: print('Files to be rotated (%s): %s' % (len(rotate_set), sorted(rotate_set)))
 
-  if verbose: print('Files to be rotated (%s): %s' % (len(rotate_list), rotate_list))
+  def make_row(fId, pa, rotate):
+    frames = count_frames(directory, pa[1], pa[3]) if directory else None
+    if verbose >= 2: print("%s: %s frames" % (pa[1], frames))
+    return {'id': fId, 'client_id': pa[0], 'path': pa[1], 'cls': pa[2], 'quality': pa[3], 'instrument': pa[4], 'rotate': rotate,
+            'number_of_frames': frames}
+
+  rows = []
 
   # process real-presentation files
   inpFile = os.path.join(os.getcwd(), real_fileList)
   idCounter = 0
   for fname in open(inpFile, 'rt'):
     idCounter += 1
-    rotate = False
     pa = get_presentation_attributes(fname) #extracts presentation attributes by parsing fname: cId, file_stem, presentation, quality, instrument
-#    print(pa)
-    if pa[1] in rotate_list: 
-        rotate = True #pa[1] is the file_stem to be stored in the database
-    if rotate:
+    rotate = pa[1] in rotate_set #pa[1] is the file_stem to be stored in the database
+    if rotate and verbose:
         print(pa[1])
-    session.add(File(idCounter, pa[0], pa[1], pa[2], pa[3], pa[4], rotate)) #(fId, client, path, presentation, quality, atype, rotation=False)
+    rows.append(make_row(idCounter, pa, rotate))
 
   #process attack-presentation files
   inpFile = os.path.join(os.getcwd(), attack_fileList)
-  rotate = False
   for fname in open(inpFile, 'rt'):
     pa = get_presentation_attributes(fname) #extracts presentation attributes by parsing fname: cId, file_stem, presentation, quality, instrument
-#    if pa[1] in rotate_list: rotate = True # test not necessary; the files needing rotation are all in the real-pres. set.
+    # the files needing rotation are all in the real-pres. set.
     idCounter += 1
-    session.add(File(idCounter, pa[0], pa[1], pa[2], pa[3], pa[4], rotate)) #(self, fId, client, path, presentation, quality, atype, rotation=False)
+    rows.append(make_row(idCounter, pa, False))
+
+  session.execute(File.__table__.insert(), rows)
   if verbose: print("%d files added to db" %(idCounter))
 
 #def add_real_lists(session, protodir, verbose):
@@ -332,16 +347,43 @@ def add_files(session, real_fileList, attack_fileList, verbose=False):
 
 
 def create_tables(args):
-  """Creates all necessary tables (only to be used at the first time)"""
+  """Creates all necessary tables (only to be used at the first time)
+
+  Secondary indexes are not created here, but by :py:func:`create_indexes`
+  once the tables are filled, which is faster than updating them row by row.
+
+  Returns the engine and the list of tables that were created.
+  """
 
+  from sqlalchemy.schema import CreateTable
   from bob.db.base.utils import create_engine_try_nolock
 
   engine = create_engine_try_nolock(args.type, args.files[0], echo=(args.verbose >= 2))
-  Client.metadata.create_all(engine)
-  File.metadata.create_all(engine)
+  created = []
+  with engine.begin() as connection:
+    for table in Base.metadata.sorted_tables:
+      if not connection.dialect.has_table(connection, table.name):
+        connection.execute(CreateTable(table))
+        created.append(table)
 #  RealAccess.metadata.create_all(engine)
 #  Attack.metadata.create_all(engine)
 #  Protocol.metadata.create_all(engine)
+  return engine, created
+
+
+def create_indexes(engine, tables, verbose=False):
+  """Creates the secondary indexes of the given tables, and gathers the
+  statistics SQLite uses to choose between them"""
+
+  from sqlalchemy import text
+
+  for table in tables:
+    for index in table.indexes:
+      if verbose: print("Creating index %s" % (index.name,))
+      index.create(engine)
+
+  with engine.begin() as connection:
+    connection.execute(text('ANALYZE'))
 
 # Driver API
 # ==========
@@ -364,9 +406,15 @@ def create(args):
     os.makedirs(os.path.dirname(dbfile))
 
   # the real work...
-  create_tables(args)
+  engine, tables = create_tables(args)
   s = session_try_nolock(args.type, args.files[0], echo=(args.verbose >= 2))
-  
+
+  # the database is rebuilt from scratch if anything fails: there is no need
+  # to keep a rollback journal on disk, nor to wait for the disk on commit.
+  from sqlalchemy import text
+  s.execute(text('PRAGMA journal_mode = MEMORY'))
+  s.execute(text('PRAGMA synchronous = OFF'))
+
   #first, get list of protocol-dictionaries via construct_protocol() 
   protocol_list = []
   protocol_files = ['clients_fold1.txt', 'clients_fold2.txt', 'clients_fold3.txt', 'clients_fold4.txt', 'clients_fold5.txt']
@@ -376,16 +424,18 @@ def create(args):
     protocol = construct_protocol(fn+1, foldFilename, foldDir, args.verbose)
     protocol_list.append(protocol)
   #fill in the Client table
-  add_clients(s, protocol_list)
+  add_clients(s, protocol_list, args.verbose)
 
   #fill in the File table
   real_list = 'bob/db/msu_mfsd_mod/folds/msu_mfsd_mod_realvids.txt'
   attack_list = 'bob/db/msu_mfsd_mod/folds/msu_mfsd_mod_attackvids.txt'
-  add_files(s, real_list, attack_list, args.verbose)
-  
+  add_files(s, real_list, attack_list, args.verbose, args.directory)
+
   s.commit()
   s.close()
 
+  create_indexes(engine, tables, args.verbose)
+
   return 0
 
 
@@ -398,6 +448,8 @@ def add_command(subparsers):
                       help="If set, I'll first erase the current database")
   parser.add_argument('-v', '--verbose', action='count', default=0,
                       help="Do SQL operations in a verbose way")
+  parser.add_argument('-d', '--directory', default=None,
+                      help="If given, the directory of the original videos: the number of frames of every video is read from its container header and stored in the database")
 #  parser.add_argument('-D', '--protodir', action='store',
 #                      default='folds', #bob.db.msu_mfsd_mod/bob/db/msu_mfsd_mod/folds
 #                      metavar='DIR',
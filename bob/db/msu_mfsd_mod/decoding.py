@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Retry policy for decoding videos.
+
+Decoding a video over a network file system may fail transiently, but a
+corrupt video fails every time. :py:class:`DecodePolicy` retries a bounded
+number of times with exponential backoff, and remembers the files that could
+not be decoded, so that the next attempts on them fail immediately.
+"""
+
+import threading
+import time
+
+
+class DecodeError(RuntimeError):
+    """Raised when a video could not be decoded, or previously failed to"""
+    pass
+
+
+class DecodePolicy(object):
+    """Bounded retries with exponential backoff, and a cache of failures.
+
+    Parameters:
+
+      retries (int): How many times a failed decode is retried.
+
+      backoff (float): The delay before the first retry, in seconds. It is
+        multiplied by ``factor`` after every retry, up to ``max_backoff``.
+
+      factor (float): The growth factor of the delay.
+
+      max_backoff (float): The maximum delay between retries, in seconds.
+
+      transient (tuple): The exception types that are retried. Other
+        exceptions are propagated immediately, without being recorded.
+    """
+
+    def __init__(self, retries=3, backoff=0.5, factor=2., max_backoff=10.,
+                 transient=(RuntimeError, IOError, OSError)):
+        self.retries = retries
+        self.backoff = backoff
+        self.factor = factor
+        self.max_backoff = max_backoff
+        self.transient = transient
+        self.failed = {}
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(
+            ('successes', 'retries', 'failures', 'fast_failures'), 0)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def run(self, key, decode):
+        """Calls ``decode()`` according to the policy.
+
+        Parameters:
+
+          key: A hashable identifying the decoded file, under which failures
+            are remembered.
+
+          decode: The function decoding the file.
+
+        Returns the result of ``decode()``.
+
+        Raises :py:class:`DecodeError` if all attempts failed, or if the file
+        already failed before.
+        """
+        if key in self.failed:
+            self._count('fast_failures')
+            raise DecodeError('%s previously failed to decode: %s' %
+                              (key, self.failed[key]))
+
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                result = decode()
+                self._count('successes')
+                return result
+            except self.transient as e:
+                error = e
+            if attempt < self.retries:
+                self._count('retries')
+                time.sleep(delay)
+                delay = min(delay * self.factor, self.max_backoff)
+
+        self._count('failures')
+        self.failed[key] = '%s: %s' % (type(error).__name__, error)
+        raise DecodeError('%s failed to decode after %d attempts: %s' %
+                          (key, self.retries + 1, self.failed[key]))
+
+    def forget(self, key=None):
+        """Forgets the failure of a file (or of all files if ``key`` is
+        ``None``), so that it is tried again"""
+        if key is None:
+            self.failed.clear()
+        else:
+            self.failed.pop(key, None)
+
+    def stats(self):
+        """Returns a dictionary with the counters of the policy"""
+        with self._lock:
+            stats = dict(self._counters)
+        stats['known_bad'] = len(self.failed)
+        return stats
+
+
+decode_policy = DecodePolicy()
+"""The policy used by :py:meth:`.VerificationFile.load`"""
@@ -35,14 +35,68 @@ def dumplist(args):
     from bob.db.base.utils import null
     output = null()
 
-  for obj in objects:
-    output.write('%s\n' % (obj.make_path(directory=args.directory, extension=args.extension),))
+  # all paths are written with a single call
+  output.write(db.paths(objects, args.directory, args.extension, joined=True))
 
   return 0
 
+def _list_directory(directory):
+  """Returns the names of the entries of a directory (empty if missing)"""
+  try:
+    return set(os.listdir(directory or '.'))
+  except OSError:
+    return set()
+
+
+def existing_paths(paths, workers=8):
+  """Returns the subset of the given paths that exist.
+
+  Paths are grouped by directory, and each directory is listed once, with the
+  listings running in a thread pool. On network file systems, this is much
+  faster than one ``os.path.exists`` call per path.
+  """
+
+  from concurrent.futures import ThreadPoolExecutor
+
+  directories = sorted(set(os.path.dirname(p) for p in paths))
+  with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+    listings = dict(zip(directories, executor.map(_list_directory, directories)))
+  return set(p for p in paths if os.path.basename(p) in listings[os.path.dirname(p)])
+
+
+def verify_video(obj, path):
+  """Opens a video container and checks its frame count and resolution.
+
+  The frame count is only checked if the database stores it, as the videos
+  have no fixed length.
+  Returns a list of problems (empty if the video is fine).
+  """
+
+  import bob.io.video
+  from .models import File
+
+  try:
+    video = bob.io.video.reader(path)
+  except (RuntimeError, IOError, OSError) as e:
+    return ['cannot be opened: %s' % e]
+
+  problems = []
+  if obj.number_of_frames is not None and \
+      video.number_of_frames != obj.number_of_frames:
+    problems.append('has %d frames, expected %d' %
+                    (video.number_of_frames, obj.number_of_frames))
+  expected = File.frame_shapes[obj.get_quality()]
+  if (video.height, video.width) != expected[1:]:
+    problems.append('has resolution %dx%d, expected %dx%d' %
+                    (video.width, video.height, expected[2], expected[1]))
+  return problems
+
+
 def checkfiles(args):
   """Checks the existence of the files based on your criteria"""
 
+  import time
+
   #from .__init__ import Database
   from .query import Database
   db = Database()
@@ -50,12 +104,23 @@ def checkfiles(args):
   #objects = db.objects(groups=args.group, cls=args.cls, qualities=args.quality, types=args.attack_type)
   objects = db.objects(quality=args.quality, instrument=args.attack_type, fold=args.fold, group=args.group, cls=args.cls)
 
+  start = time.time()
+
   # go through all files, check if they are available on the filesystem
-  good = []
-  bad = []
-  for obj in objects:
-    if os.path.exists(obj.make_path(directory=args.directory, extension=args.extension)): good.append(obj)
-    else: bad.append(obj)
+  paths = [obj.make_path(directory=args.directory, extension=args.extension) for obj in objects]
+  existing = existing_paths(paths, args.workers)
+  good = [(obj, path) for obj, path in zip(objects, paths) if path in existing]
+  bad = [(obj, path) for obj, path in zip(objects, paths) if path not in existing]
+
+  # optionally, open every container and check its contents
+  broken = []
+  if args.verify:
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+      problems = list(executor.map(lambda k: verify_video(*k), good))
+    broken = [(path, p) for (obj, path), p in zip(good, problems) if p]
+
+  elapsed = time.time() - start
 
   # report
   output = sys.stdout
@@ -64,11 +129,40 @@ def checkfiles(args):
     output = null()
 
   if bad:
-    for obj in bad:
-      output.write('Cannot find file "%s"\n' % (obj.make_path(directory=args.directory, extension=args.extension),))
+    for obj, path in bad:
+      output.write('Cannot find file "%s"\n' % (path,))
     output.write('%d files (out of %d) were not found at "%s"\n' % \
         (len(bad), len(objects), args.directory))
 
+  if broken:
+    for path, problems in broken:
+      for problem in problems:
+        output.write('File "%s" %s\n' % (path, problem))
+    output.write('%d files (out of %d) failed verification\n' % \
+        (len(broken), len(good)))
+
+  output.write('%d files checked in %.2f s (%.1f files/s)\n' % \
+      (len(objects), elapsed, len(objects) / max(elapsed, 1e-9)))
+
+  return 0
+
+def explain(args):
+  """Prints the SQLite query plan of a query based on your criteria"""
+
+  from .query import Database
+  db = Database()
+
+  sql, plan = db.explain(quality=args.quality, instrument=args.attack_type, fold=args.fold, group=args.group, cls=args.cls, ids=args.ids)
+
+  output = sys.stdout
+  if args.selftest:
+    from bob.db.base.utils import null
+    output = null()
+
+  output.write('%s\n\nQUERY PLAN\n' % (sql,))
+  for line in plan:
+    output.write('  %s\n' % (line,))
+
   return 0
 
 class Interface(BaseInterface):
@@ -100,9 +194,11 @@ class Interface(BaseInterface):
 
   def files(self):
 
-    from pkg_resources import resource_filename
+    # the package is not zip-safe: resources are plain files next to this
+    # module, which avoids importing pkg_resources
+    basedir = os.path.dirname(os.path.abspath(__file__))
     raw_files = ('db.sql3',)
-    return [resource_filename(__name__, k) for k in raw_files]
+    return [os.path.join(basedir, k) for k in raw_files]
 
 
   def version(self):
@@ -122,14 +218,31 @@ class Interface(BaseInterface):
 
     from argparse import SUPPRESS
 
-    from .query import Database
-    db = Database()
+    # NOTE: the choices are static; the database itself is only opened by the
+    # subcommand that is run, so building the parser stays cheap.
+    from .models import Client, File
 
 
    # get the "create" action from a submodule
     from .create import add_command as create_command
     create_command(subparsers)
 
+    # get the "materialize" action from a submodule
+    from .framestore import add_command as materialize_command
+    materialize_command(subparsers)
+
+    # get the "faceindex" action from a submodule
+    from .faceindex import add_command as faceindex_command
+    faceindex_command(subparsers)
+
+    # get the "faces" action from a submodule
+    from .faces import add_command as faces_command
+    faces_command(subparsers)
+
+    # get the "features" action from a submodule
+    from .features import add_command as features_command
+    features_command(subparsers)
+
 
     # add the dumplist command
     dump_message = "Dumps list of files based on your criteria"
@@ -137,11 +250,11 @@ class Interface(BaseInterface):
     dump_parser.add_argument('-d', '--directory', dest="directory", default='', help="if given, this path will be prepended to every entry returned (defaults to '%(default)s')")
     dump_parser.add_argument('-e', '--extension', dest="extension", default='', help="if given, this extension will be appended to every entry returned (defaults to '%(default)s')")
 
-    dump_parser.add_argument('-c', '--class', dest="cls", default=None, help="if given, limits the dump to a particular subset of the data that corresponds to the given class (defaults to '%(default)s')", choices=db.presentation_classes())
-    dump_parser.add_argument('-f', '--fold', dest="fold", default=None, help="if given, limits the dump to a particular subset of the data that corresponds to the given fold (defaults to '%(default)s')", choices=db.folds())
-    dump_parser.add_argument('-g', '--group', dest="group", default=None, help="if given, this value will limit the output files to those belonging to a particular group. (defaults to '%(default)s')", choices=db.groups())
-    dump_parser.add_argument('-q', '--quality', dest="quality", default=None, help="if given, this value will limit the output files to those belonging to a particular quality of recording. (defaults to '%(default)s')", choices=db.qualities())
-    dump_parser.add_argument('-t', '--type', dest="attack_type", default=None, help="if given, this value will limit the output files to those belonging to a particular type of attack. (defaults to '%(default)s')", choices=db.attack_instruments())
+    dump_parser.add_argument('-c', '--class', dest="cls", default=None, help="if given, limits the dump to a particular subset of the data that corresponds to the given class (defaults to '%(default)s')", choices=File.presentation_choices)
+    dump_parser.add_argument('-f', '--fold', dest="fold", default=None, help="if given, limits the dump to a particular subset of the data that corresponds to the given fold (defaults to '%(default)s')", choices=Client.fold_choices)
+    dump_parser.add_argument('-g', '--group', dest="group", default=None, help="if given, this value will limit the output files to those belonging to a particular group. (defaults to '%(default)s')", choices=Client.group_choices)
+    dump_parser.add_argument('-q', '--quality', dest="quality", default=None, help="if given, this value will limit the output files to those belonging to a particular quality of recording. (defaults to '%(default)s')", choices=File.quality_choices)
+    dump_parser.add_argument('-t', '--type', dest="attack_type", default=None, help="if given, this value will limit the output files to those belonging to a particular type of attack. (defaults to '%(default)s')", choices=File.instrument_choices)
 
     dump_parser.add_argument('--self-test', dest="selftest", default=False, action='store_true', help=SUPPRESS)
     dump_parser.set_defaults(func=dumplist) #action
@@ -152,14 +265,30 @@ class Interface(BaseInterface):
     check_parser.add_argument('-d', '--directory', dest="directory", default='', help="if given, this path will be prepended to every entry returned (defaults to '%(default)s')")
     check_parser.add_argument('-e', '--extension', dest="extension", default='', help="if given, this extension will be appended to every entry returned (defaults to '%(default)s')")
 
-    check_parser.add_argument('-c', '--class', dest="cls", default=None, help="if given, limits the dump to a particular subset of the data that corresponds to the given class (defaults to '%(default)s')", choices=db.presentation_classes())
-    check_parser.add_argument('-f', '--fold', dest="fold", default=None, help="if given, this value will limit the output files to those belonging to a particular fold. (defaults to '%(default)s')", choices=db.folds())
-    check_parser.add_argument('-g', '--group', dest="group", default=None, help="if given, this value will limit the output files to those belonging to a particular group. (defaults to '%(default)s')", choices=db.groups())
-    check_parser.add_argument('-q', '--quality', dest="quality", default=None, help="if given, this value will limit the output files to those belonging to a particular quality of recording. (defaults to '%(default)s')", choices=db.qualities())
-    check_parser.add_argument('-t', '--type', dest="attack_type", default=None, help="if given, this value will limit the output files to those belonging to a particular type of attack. (defaults to '%(default)s')", choices=db.attack_instruments())
+    check_parser.add_argument('-c', '--class', dest="cls", default=None, help="if given, limits the dump to a particular subset of the data that corresponds to the given class (defaults to '%(default)s')", choices=File.presentation_choices)
+    check_parser.add_argument('-f', '--fold', dest="fold", default=None, help="if given, this value will limit the output files to those belonging to a particular fold. (defaults to '%(default)s')", choices=Client.fold_choices)
+    check_parser.add_argument('-g', '--group', dest="group", default=None, help="if given, this value will limit the output files to those belonging to a particular group. (defaults to '%(default)s')", choices=Client.group_choices)
+    check_parser.add_argument('-q', '--quality', dest="quality", default=None, help="if given, this value will limit the output files to those belonging to a particular quality of recording. (defaults to '%(default)s')", choices=File.quality_choices)
+    check_parser.add_argument('-t', '--type', dest="attack_type", default=None, help="if given, this value will limit the output files to those belonging to a particular type of attack. (defaults to '%(default)s')", choices=File.instrument_choices)
+
+    check_parser.add_argument('-j', '--workers', dest="workers", default=8, type=int, help="the number of threads used to check the files (defaults to %(default)s)")
+    check_parser.add_argument('--verify', dest="verify", default=False, action='store_true', help="if set, also opens every video and checks its resolution, and its number of frames if the database stores it")
 
     check_parser.add_argument('--self-test', dest="selftest", default=False, action='store_true', help=SUPPRESS)
     check_parser.set_defaults(func=checkfiles) #action
 
+    # add the explain command
+    explain_message = "Prints the SQLite query plan of a query, based on your criteria"
+    explain_parser = subparsers.add_parser('explain', help=explain_message)
+    explain_parser.add_argument('-c', '--class', dest="cls", default=None, help="if given, limits the query to a particular class (defaults to '%(default)s')", choices=File.presentation_choices)
+    explain_parser.add_argument('-f', '--fold', dest="fold", default=None, help="if given, limits the query to a particular fold (defaults to '%(default)s')", choices=Client.fold_choices)
+    explain_parser.add_argument('-g', '--group', dest="group", default=None, help="if given, limits the query to a particular group (defaults to '%(default)s')", choices=Client.group_choices)
+    explain_parser.add_argument('-q', '--quality', dest="quality", default=None, help="if given, limits the query to a particular quality of recording (defaults to '%(default)s')", choices=File.quality_choices)
+    explain_parser.add_argument('-t', '--type', dest="attack_type", default=None, help="if given, limits the query to a particular type of attack (defaults to '%(default)s')", choices=File.instrument_choices)
+    explain_parser.add_argument('-i', '--ids', dest="ids", default=None, nargs='+', help="if given, limits the query to these client ids (defaults to '%(default)s')")
+
+    explain_parser.add_argument('--self-test', dest="selftest", default=False, action='store_true', help=SUPPRESS)
+    explain_parser.set_defaults(func=explain) #action
+
 
 
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""A compact binary index of the face locations of all videos.
+
+Parsing the ``.face`` text files is slow compared to the rest of a face-crop
+pipeline. The index stores the already converted bounding boxes of all files in
+a single ``.npz`` file next to the ``.face`` files, which is parsed once per
+process. Build it with ``bob_dbmanage.py msu_mfsd_mod faceindex``.
+"""
+
+import os
+import threading
+import numpy
+
+
+INDEX_FILENAME = 'face-index.npz'
+"""The name of the index file, inside the directory of the ``.face`` files"""
+
+OFFSETS_DTYPE = numpy.dtype([
+    ('id', '<i8'),
+    ('start', '<i8'),
+    ('stop', '<i8'),
+])
+"""The layout of the per-file offset table of the index"""
+
+
+def parse(filename):
+    """Parses a ``.face`` file.
+
+    Returns a :py:class:`numpy.ndarray` with one row per frame, in which the
+    bottom-right corner of the bounding box is replaced by its width and
+    height, as returned by :py:meth:`.File.bbx`.
+    """
+    coords = numpy.loadtxt(filename, delimiter=',', ndmin=2)
+    coords[:, 3] = coords[:, 3] - coords[:, 1]
+    coords[:, 4] = coords[:, 4] - coords[:, 2]
+    return coords
+
+
+class FaceIndex(object):
+    """Read access to the face locations of all files.
+
+    Parameters:
+
+      filename (str): The path to the index file.
+    """
+
+    def __init__(self, filename):
+        with numpy.load(filename) as data:
+            self.coords = data['coords']
+            self.offsets = data['offsets']
+        # all returned views are read-only, as they share the same memory
+        self.coords.flags.writeable = False
+        self._offsets = dict((int(r['id']), (int(r['start']), int(r['stop'])))
+                             for r in self.offsets)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __contains__(self, file_id):
+        return file_id in self._offsets
+
+    def get(self, file_id):
+        """Returns a read-only view on the face locations of a file.
+
+        Raises :py:class:`KeyError` if the file is not in the index.
+        """
+        start, stop = self._offsets[file_id]
+        return self.coords[start:stop]
+
+
+def build(files, directory, output=None):
+    """Parses the ``.face`` files of all given files into one index.
+
+    Parameters:
+
+      files: The :py:class:`.File` objects to be indexed.
+
+      directory (str): The directory containing the ``.face`` files.
+
+      output (str): The path of the index. Defaults to ``INDEX_FILENAME``
+        inside ``directory``.
+
+    Returns the path of the index.
+    """
+    if output is None:
+        output = os.path.join(directory, INDEX_FILENAME)
+
+    blocks = []
+    offsets = []
+    start = 0
+    for f in files:
+        coords = parse(f.facefile(directory))
+        blocks.append(coords)
+        offsets.append((f.id, start, start + len(coords)))
+        start += len(coords)
+
+    coords = numpy.vstack(blocks) if blocks else numpy.zeros((0, 5))
+    offsets = numpy.array(offsets, dtype=OFFSETS_DTYPE)
+
+    # numpy.savez() appends '.npz' to names not ending with it
+    tmpfile = output + '.tmp.npz'
+    numpy.savez(tmpfile, coords=coords, offsets=offsets)
+    os.rename(tmpfile, output)
+    with _lock:
+        _indices.pop(output, None)
+    return output
+
+
+_indices = {}
+_parsed = {}
+_lock = threading.Lock()
+
+
+def get_index(directory):
+    """Returns the :py:class:`FaceIndex` of a directory of ``.face`` files, or
+    ``None`` if it has no index. Indices are loaded once per process."""
+    filename = os.path.join(directory, INDEX_FILENAME)
+    with _lock:
+        if filename not in _indices:
+            _indices[filename] = (FaceIndex(filename)
+                                  if os.path.exists(filename) else None)
+        return _indices[filename]
+
+
+def load(filename, cache=False):
+    """Parses a ``.face`` file, optionally keeping the (read-only) result in
+    memory for the next calls."""
+    if not cache:
+        return parse(filename)
+    with _lock:
+        coords = _parsed.get(filename)
+    if coords is None:
+        coords = parse(filename)
+        coords.flags.writeable = False
+        with _lock:
+            _parsed[filename] = coords
+    return coords
+
+
+def faceindex(args):
+    """Builds the binary index of the face locations of all videos"""
+
+    from .query import Database
+    db = Database()
+    objects = db.objects()
+
+    output = build(objects, args.directory)
+    if args.verbose:
+        print('%d files indexed in "%s"' % (len(objects), output))
+
+    return 0
+
+
+def add_command(subparsers):
+    """Add specific subcommands that the action "faceindex" can use"""
+
+    parser = subparsers.add_parser('faceindex', help=faceindex.__doc__)
+
+    parser.add_argument('-d', '--directory', required=True,
+                        help="The directory containing the .face files")
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help="Print a summary at the end")
+
+    parser.set_defaults(func=faceindex)  # action
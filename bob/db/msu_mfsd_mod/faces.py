@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Batched extraction of the face crops of the videos.
+
+:py:func:`crop` cuts the bounding boxes of :py:meth:`.File.bbx` out of a stack
+of frames and resizes them (nearest neighbour) with a single advanced-indexing
+operation, without any per-frame Python loop. :py:meth:`.File.load_faces`
+combines it with :py:meth:`.File.load`, and the ``faces`` subcommand of
+``bob_dbmanage.py msu_mfsd_mod`` extracts the faces of all videos at once,
+either to one HDF5 file per video or to a :py:class:`FaceStore`.
+"""
+
+import os
+import numpy
+
+from .framestore import FrameStore, FrameStoreWriter
+from .utils import atomic_path
+
+
+DEFAULT_SIZE = (64, 64)
+"""The default ``(height, width)`` of the face crops"""
+
+STORE_INDEX = 'faces-index.npy'
+"""The name of the index of a store of face crops; it differs from the one of
+a frame store, so that :py:func:`bob.db.msu_mfsd_mod.framestore.get_store`
+never serves face crops as video frames."""
+
+STORE_FRAMES = 'faces-frames.npy'
+"""The name of the frame numbers of the crops of a store of face crops, in
+the order of the crops"""
+
+
+def sampling_grid(boxes, size, shape):
+    """Returns the rows and columns sampled by a nearest-neighbour resize.
+
+    Parameters:
+
+      boxes (numpy.ndarray): A ``(N, 4)`` array of ``(x, y, width, height)``
+        bounding boxes.
+
+      size (tuple): The ``(height, width)`` of the crops.
+
+      shape (tuple): The ``(height, width)`` of the frames. Samples outside of
+        the frames are clamped to their border.
+
+    Returns the ``(N, height)`` rows and the ``(N, width)`` columns.
+    """
+    boxes = numpy.asarray(boxes, dtype=numpy.float64)
+    grid = []
+    for axis, (origin, extent) in enumerate(((1, 3), (0, 2))):
+        steps = (numpy.arange(size[axis]) + 0.5) / size[axis]
+        samples = numpy.floor(boxes[:, origin, None] +
+                              steps * boxes[:, extent, None])
+        grid.append(numpy.clip(samples, 0, shape[axis] - 1).astype(numpy.intp))
+    return tuple(grid)
+
+
+def crop(frames, boxes, size=DEFAULT_SIZE, out=None):
+    """Crops and resizes one bounding box per frame.
+
+    Parameters:
+
+      frames (numpy.ndarray): A ``(N, channels, height, width)`` stack of
+        frames.
+
+      boxes (numpy.ndarray): A ``(N, 4)`` array with the ``(x, y, width,
+        height)`` bounding box of each frame.
+
+      size (tuple): The ``(height, width)`` of the crops.
+
+      out (numpy.ndarray): An optional ``(N, channels, height, width)`` array
+        where the crops are written.
+
+    Returns the ``(N, channels, height, width)`` crops, with the type of
+    ``frames``.
+    """
+    if len(frames) != len(boxes):
+        raise ValueError('got %d frames but %d bounding boxes' %
+                         (len(frames), len(boxes)))
+    rows, columns = sampling_grid(boxes, size, frames.shape[-2:])
+    index = (numpy.arange(len(frames))[:, None, None, None],
+             numpy.arange(frames.shape[1])[None, :, None, None],
+             rows[:, None, :, None],
+             columns[:, None, None, :])
+    if out is None:
+        return frames[index]
+    out[...] = frames[index]
+    return out
+
+
+class FaceStore(FrameStore):
+    """Read access to a store of face crops built by
+    :py:class:`FaceStoreWriter`.
+
+    :py:meth:`get` returns the crops of a file, like a
+    :py:class:`.FrameStore`, and :py:meth:`numbers` the frames they were
+    cropped from.
+
+    Parameters:
+
+      directory (str): The directory containing the store.
+    """
+
+    def __init__(self, directory):
+        FrameStore.__init__(self, directory, STORE_INDEX)
+        numbers = numpy.load(os.path.join(directory, STORE_FRAMES))
+        offsets = numpy.cumsum(self.index['frames']) - self.index['frames']
+        self._numbers = dict(
+            (int(row['id']), numbers[offset:offset + int(row['frames'])])
+            for row, offset in zip(self.index, offsets))
+
+    def numbers(self, file_id):
+        """Returns the frame numbers of the crops of a file.
+
+        Raises :py:class:`KeyError` if the file is not in the store.
+        """
+        return self._numbers[file_id]
+
+    def get_faces(self, file_id):
+        """Returns the crops of a file and their frame numbers, as
+        :py:meth:`.File.load_faces` does"""
+        return self.get(file_id), self.numbers(file_id)
+
+
+class FaceStoreWriter(FrameStoreWriter):
+    """Packs face crops and their frame numbers into a new
+    :py:class:`FaceStore`, to be used as a context manager.
+
+    Parameters:
+
+      directory (str): The directory of the store. It is created if needed.
+    """
+
+    def __init__(self, directory):
+        FrameStoreWriter.__init__(self, directory, STORE_INDEX)
+        self._numbers = []
+
+    def append(self, file_id, crops, numbers):
+        """Appends the ``(N, 3, height, width)`` crops of one file, and the
+        ``N`` frame numbers they were cropped from; returns ``N``"""
+        numbers = numpy.asarray(numbers, dtype='<i8')
+        if len(numbers) != len(crops):
+            raise ValueError('got %d crops but %d frame numbers for file %d' %
+                             (len(crops), len(numbers), file_id))
+        count = FrameStoreWriter.append(self, file_id, crops)
+        self._numbers.append(numbers)
+        return count
+
+    def close(self):
+        """Writes the frame numbers and the index, and moves the store in
+        place"""
+        path = os.path.join(self.directory, STORE_FRAMES)
+        with atomic_path(path) as tmpfile:
+            with open(tmpfile, 'wb') as f:
+                numpy.save(f, numpy.concatenate(
+                    self._numbers or [numpy.zeros((0,), dtype='<i8')]))
+            FrameStoreWriter.close(self)
+
+
+def _save(obj, directory, crops, numbers):
+    """Writes the faces of a file and their frame numbers to HDF5, as
+    atomically as :py:meth:`.File.save`"""
+    import bob.io.base
+    path = obj.make_path(directory, '.hdf5')
+    bob.io.base.create_directories_safe(os.path.dirname(path))
+    with atomic_path(path) as tmpfile:
+        hdf5 = bob.io.base.HDF5File(tmpfile, 'w')
+        hdf5.set('faces', crops)
+        hdf5.set('frames', numbers)
+        del hdf5  # closes the file
+
+
+def faces(args):
+    """Extracts the face crops of all videos"""
+
+    from .query import Database
+    db = Database()
+    objects = db.objects()
+
+    size = tuple(args.size)
+    writer = None
+    if args.format == 'store':
+        writer = FaceStoreWriter(args.output)
+
+    total = 0
+    try:
+        for obj in objects:
+            crops, numbers = obj.load_faces(args.directory, size,
+                                            bbx_directory=args.bbx_directory)
+            if writer is not None:
+                writer.append(obj.id, crops, numbers)
+            else:
+                _save(obj, args.output, crops, numbers)
+            total += len(crops)
+            if args.verbose:
+                print('%s: %d faces' % (obj.path, len(crops)))
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    if writer is not None:
+        writer.close()
+
+    if args.verbose:
+        print('%d faces of %d videos written to "%s"' %
+              (total, len(objects), args.output))
+
+    return 0
+
+
+def add_command(subparsers):
+    """Add specific subcommands that the action "faces" can use"""
+
+    parser = subparsers.add_parser('faces', help=faces.__doc__)
+
+    parser.add_argument('-d', '--directory', required=True,
+                        help="The directory containing the original videos")
+    parser.add_argument('-b', '--bbx-directory', default=None,
+                        help="The directory containing the .face files "
+                             "(defaults to the ones shipped with the package)")
+    parser.add_argument('-o', '--output', required=True,
+                        help="The directory where the faces are written")
+    parser.add_argument('-s', '--size', type=int, nargs=2,
+                        default=DEFAULT_SIZE, metavar=('HEIGHT', 'WIDTH'),
+                        help="The size of the face crops "
+                             "(defaults to %(default)s)")
+    parser.add_argument('-f', '--format', choices=('hdf5', 'store'),
+                        default='hdf5',
+                        help="Write one HDF5 file per video, with the 'faces' "
+                             "and the 'frames' numbers, or a single store "
+                             "indexed by '%s', with the frame numbers in '%s' "
+                             "(defaults to '%%(default)s')" %
+                             (STORE_INDEX, STORE_FRAMES))
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help="Print the number of faces of every video")
+
+    parser.set_defaults(func=faces)  # action
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""A persistent cache of the features extracted from the database files.
+
+Every entry is keyed by the id of a :py:class:`.File`, the name of the
+feature extractor and a hash of its parameters, and stored with
+:py:meth:`.File.save` under ``<directory>/<extractor>/<hash>/``. A manifest
+(``manifest.json``) records what produced every entry, its size and when it
+was last used, so that existence checks do not touch the file system and old
+entries can be pruned with ``bob_dbmanage.py msu_mfsd_mod features``::
+
+  cache = FeatureCache('/idiap/temp/features')
+  params = {'radius': 1, 'neighbors': 8}
+  lbp = cache.get_or_compute(f, 'lbp', params, lambda: extract(f.load()))
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .utils import atomic_path
+
+
+MANIFEST = 'manifest.json'
+"""The name of the manifest file, inside the cache directory"""
+
+LOCK = 'manifest.lock'
+"""The name of the file locked while the manifest is updated"""
+
+
+def params_hash(params):
+    """Returns a short, stable hash of the parameters of an extractor.
+
+    ``params`` must be serializable as JSON (objects that are not are
+    serialized with :py:func:`repr`); the order of dictionary keys does not
+    matter.
+    """
+    text = json.dumps(params, sort_keys=True, default=repr)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def parse_size(text):
+    """Parses a size in bytes, with an optional ``K``, ``M``, ``G`` or ``T``
+    suffix (powers of 1024)"""
+    text = text.strip().upper().rstrip('B')
+    units = 'KMGT'
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * 1024 ** (units.index(text[-1]) + 1))
+    return int(text)
+
+
+class FeatureCache(object):
+    """Stores and retrieves features, keyed by file, extractor and parameters.
+
+    All methods are thread-safe. Several processes may share a cache: entries
+    are written atomically, and the manifest is merged with its version on
+    disk every time it is saved, while holding an exclusive
+    :py:func:`fcntl.flock` lock on ``manifest.lock``. The merge only carries
+    over the entries this instance stored or read since it last saved the
+    manifest; any other entry missing on disk was removed by another process,
+    and is dropped.
+
+    Parameters:
+
+      directory (str): The directory of the cache. It is created if needed.
+
+      extension (str): The extension of the entries, which selects the codec
+        of :py:meth:`.File.save`.
+
+      compression (int): The HDF5 compression level of the entries, from 0
+        (none) to 9.
+    """
+
+    def __init__(self, directory, extension='.hdf5', compression=0):
+        self.directory = directory
+        self.extension = extension
+        self.compression = compression
+        self._lock = threading.Lock()
+        self._manifest = self._read_manifest()
+        self._written = set()  # keys stored since the last merge
+        self._accessed = set()  # keys read since the last merge
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.directory, MANIFEST), 'rt') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        """Locks the manifest against the other threads and processes"""
+        import fcntl
+        with self._lock:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            with open(os.path.join(self.directory, LOCK), 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write_manifest(self, removed=()):
+        """Merges the manifest with the one on disk and saves it atomically;
+        must be called within :py:meth:`_exclusive`"""
+        manifest = self._read_manifest()
+        for key in removed:
+            manifest.pop(key, None)
+            self._written.discard(key)
+            self._accessed.discard(key)
+        for key in self._written:
+            entry = self._manifest[key]
+            other = manifest.get(key)
+            if other is None or other['accessed'] <= entry['accessed']:
+                manifest[key] = entry
+        for key in self._accessed - self._written:
+            # only refreshes the entries that still exist
+            other = manifest.get(key)
+            if other is not None:
+                other['accessed'] = max(other['accessed'],
+                                        self._manifest[key]['accessed'])
+        self._manifest = manifest
+        self._written.clear()
+        self._accessed.clear()
+        with atomic_path(os.path.join(self.directory, MANIFEST)) as tmpfile:
+            with open(tmpfile, 'wt') as f:
+                json.dump(manifest, f, sort_keys=True)
+
+    @staticmethod
+    def key(file, extractor, params=None):
+        """Returns the key of the manifest entry of a file's features"""
+        return '%d/%s/%s' % (file.id, extractor, params_hash(params))
+
+    def _directory(self, extractor, params):
+        return os.path.join(self.directory, extractor, params_hash(params))
+
+    def __len__(self):
+        return len(self._manifest)
+
+    def contains(self, file, extractor, params=None):
+        """Whether the features of a file are in the cache, according to the
+        manifest"""
+        return self.key(file, extractor, params) in self._manifest
+
+    def get(self, file, extractor, params=None):
+        """Returns the cached features of a file, or ``None`` if there are
+        none"""
+        key = self.key(file, extractor, params)
+        with self._lock:
+            entry = self._manifest.get(key)
+            if entry is None:
+                return None
+            entry['accessed'] = time.time()
+            self._accessed.add(key)
+        import bob.io.base
+        path = file.make_path(self._directory(extractor, params),
+                              self.extension)
+        try:
+            return bob.io.base.load(path)
+        except (IOError, OSError, RuntimeError):
+            # deleted behind the back of the manifest
+            with self._exclusive():
+                self._manifest.pop(key, None)
+                self._write_manifest(removed=(key,))
+            return None
+
+    def put(self, file, extractor, params, data):
+        """Stores the features of a file, replacing any previous entry"""
+        directory = self._directory(extractor, params)
+        # File.save() writes atomically, so readers never see a partial file
+        file.save(data, directory, self.extension, self.compression)
+        path = file.make_path(directory, self.extension)
+
+        now = time.time()
+        key = self.key(file, extractor, params)
+        with self._exclusive():
+            self._written.add(key)
+            self._manifest[key] = {
+                'file_id': file.id,
+                'extractor': extractor,
+                'params': json.loads(json.dumps(params, default=repr)),
+                'path': os.path.relpath(path, self.directory),
+                'bytes': os.path.getsize(path),
+                'created': now,
+                'accessed': now,
+            }
+            self._write_manifest()
+
+    def get_or_compute(self, file, extractor, params, compute):
+        """Returns the cached features of a file, or computes them with
+        ``compute()`` and stores them"""
+        data = self.get(file, extractor, params)
+        if data is None:
+            data = compute()
+            self.put(file, extractor, params, data)
+        return data
+
+    def flush(self):
+        """Saves the access times of the entries read since the last write"""
+        with self._exclusive():
+            self._write_manifest()
+
+    def size(self):
+        """Returns the total size of the entries, in bytes"""
+        return sum(e['bytes'] for e in list(self._manifest.values()))
+
+    def summary(self):
+        """Returns the number of entries and bytes of every extractor and
+        parameter hash"""
+        summary = {}
+        for key, entry in list(self._manifest.items()):
+            name = key.split('/', 1)[1]
+            count, size = summary.get(name, (0, 0))
+            summary[name] = (count + 1, size + entry['bytes'])
+        return summary
+
+    def prune(self, max_bytes):
+        """Removes the least recently used entries until the cache holds at
+        most ``max_bytes``; returns the number of removed entries"""
+        with self._exclusive():
+            self._write_manifest()
+            entries = sorted(self._manifest.items(),
+                             key=lambda item: item[1]['accessed'])
+            total = sum(entry['bytes'] for _, entry in entries)
+            removed = []
+            for key, entry in entries:
+                if total <= max_bytes:
+                    break
+                try:
+                    os.unlink(os.path.join(self.directory, entry['path']))
+                except OSError:
+                    pass
+                total -= entry['bytes']
+                removed.append(key)
+                del self._manifest[key]
+            self._write_manifest(removed)
+        return len(removed)
+
+
+def features(args):
+    """Summarizes and prunes a feature cache"""
+
+    cache = FeatureCache(args.directory)
+    if args.prune is not None:
+        removed = cache.prune(parse_size(args.prune))
+        if args.verbose:
+            print('%d entries removed' % removed)
+
+    for name, (count, size) in sorted(cache.summary().items()):
+        print('%s: %d entries, %d bytes' % (name, count, size))
+    if args.verbose:
+        print('total: %d entries, %d bytes' % (len(cache), cache.size()))
+
+    return 0
+
+
+def add_command(subparsers):
+    """Add specific subcommands that the action "features" can use"""
+
+    parser = subparsers.add_parser('features', help=features.__doc__)
+
+    parser.add_argument('-d', '--directory', required=True,
+                        help="The directory of the feature cache")
+    parser.add_argument('-p', '--prune', metavar='SIZE', default=None,
+                        help="Removes the least recently used entries until "
+                             "the cache is below this size, e.g. 20G")
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help="Print the totals")
+
+    parser.set_defaults(func=features)  # action
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""A pre-decoded, memory-mapped store for the frames of all videos.
+
+The store is a directory with two files:
+
+``frames.raw``
+  The rotation-corrected frames of all videos, packed one after the other as
+  raw ``uint8`` ``(N, 3, height, width)`` blocks.
+
+``index.npy``
+  A structured array with one row per video, giving the file id, the byte
+  offset of the block in ``frames.raw`` and its shape.
+
+Once built with ``bob_dbmanage.py msu_mfsd_mod materialize``, point the
+``bob.db.msu_mfsd_mod.frame_store`` configuration variable (see
+``bob.extension.rc``) to the store directory or call
+:py:func:`set_store`. :py:meth:`.File.load` and :py:meth:`.VerificationFile.load`
+then return read-only :py:class:`numpy.memmap` slices of the store instead of
+decoding the videos, so frames are shared between processes through the page
+cache.
+"""
+
+import os
+import numpy
+
+
+RC_KEY = 'bob.db.msu_mfsd_mod.frame_store'
+"""The configuration variable holding the directory of the default store"""
+
+INDEX_DTYPE = numpy.dtype([
+    ('id', '<i8'),
+    ('offset', '<i8'),
+    ('frames', '<i8'),
+    ('channels', '<i4'),
+    ('height', '<i4'),
+    ('width', '<i4'),
+])
+"""The layout of the rows of ``index.npy``"""
+
+INDEX_FILENAME = 'index.npy'
+"""The name of the index of a store of video frames, the only one opened by
+:py:func:`get_store`"""
+
+
+def _paths(directory, index=INDEX_FILENAME):
+    return (os.path.join(directory, 'frames.raw'),
+            os.path.join(directory, index))
+
+
+class FrameStore(object):
+    """Read access to a frame store built by :py:class:`FrameStoreWriter`.
+
+    Parameters:
+
+      directory (str): The directory containing the store.
+
+      index (str): The name of the index file. Stores of other arrays than
+        the frames of the videos (e.g. face crops) use a different name, so
+        that they are never mistaken for a frame store.
+    """
+
+    def __init__(self, directory, index=INDEX_FILENAME):
+        self.directory = directory
+        raw, index = _paths(directory, index)
+        self.index = numpy.load(index)
+        self._rows = dict((int(r['id']), r) for r in self.index)
+        if os.path.getsize(raw):
+            self._data = numpy.memmap(raw, dtype=numpy.uint8, mode='r')
+        else:
+            self._data = numpy.zeros((0,), dtype=numpy.uint8)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, file_id):
+        return file_id in self._rows
+
+    def ids(self):
+        """Returns the ids of all files in the store"""
+        return sorted(self._rows)
+
+    def get(self, file_id):
+        """Returns the frames of a file as a read-only, zero-copy view.
+
+        Returns a :py:class:`numpy.memmap` with shape
+        ``(frames, channels, height, width)``.
+
+        Raises :py:class:`KeyError` if the file is not in the store.
+        """
+        row = self._rows[file_id]
+        shape = (int(row['frames']), int(row['channels']),
+                 int(row['height']), int(row['width']))
+        start = int(row['offset'])
+        stop = start + int(numpy.prod(shape))
+        return self._data[start:stop].reshape(shape)
+
+
+class FrameStoreWriter(object):
+    """Packs frames into a new store, to be used as a context manager.
+
+    The store is written under temporary names and only moved in place when
+    the writer is closed without errors.
+
+    Parameters:
+
+      directory (str): The directory of the store. It is created if needed.
+
+      index (str): The name of the index file, see :py:class:`FrameStore`.
+    """
+
+    def __init__(self, directory, index=INDEX_FILENAME):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self._raw, self._index = _paths(directory, index)
+        self._output = open(self._raw + '.tmp', 'wb')
+        self._rows = []
+        self._offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def append(self, file_id, frames):
+        """Appends the frames of one file to the store.
+
+        Parameters:
+
+          file_id (int): The id of the file the frames belong to.
+
+          frames: A ``(N, 3, height, width)`` array or any iterable of
+            ``(3, height, width)`` frames, e.g. :py:meth:`.File.iter_frames`.
+            Frames are written as they come, so a generator keeps the memory
+            use at one frame.
+
+        Returns the number of frames written.
+        """
+        count = 0
+        shape = (0, 0, 0)
+        for frame in frames:
+            frame = numpy.ascontiguousarray(frame, dtype=numpy.uint8)
+            if count and frame.shape != shape:
+                raise ValueError(
+                    'frame %d of file %d has shape %s, expected %s' %
+                    (count, file_id, frame.shape, shape))
+            shape = frame.shape
+            self._output.write(frame.tobytes())
+            count += 1
+        self._rows.append((file_id, self._offset, count) + tuple(shape))
+        self._offset += count * int(numpy.prod(shape))
+        return count
+
+    def close(self):
+        """Writes the index and moves the store in place"""
+        self._output.close()
+        index = numpy.array(self._rows, dtype=INDEX_DTYPE)
+        with open(self._index + '.tmp', 'wb') as f:
+            numpy.save(f, index)
+        os.rename(self._raw + '.tmp', self._raw)
+        os.rename(self._index + '.tmp', self._index)
+
+    def abort(self):
+        """Discards everything written so far"""
+        self._output.close()
+        os.unlink(self._raw + '.tmp')
+
+
+_store = None
+
+
+def get_store():
+    """Returns the default :py:class:`FrameStore`, or ``None`` if there is none.
+
+    Unless set with :py:func:`set_store`, the store is opened from the
+    directory given in the ``bob.db.msu_mfsd_mod.frame_store`` configuration
+    variable, the first time this function is called.
+    """
+    global _store
+    if _store is None:
+        from bob.extension import rc
+        directory = rc.get(RC_KEY)
+        if directory and os.path.exists(_paths(directory)[1]):
+            _store = FrameStore(directory)
+        else:
+            _store = False
+    return _store or None
+
+
+def set_store(directory):
+    """Sets (or, with ``None``, disables) the default frame store"""
+    global _store
+    _store = FrameStore(directory) if directory else False
+
+
+def materialize(args):
+    """Decodes all videos once into a memory-mapped frame store"""
+
+    from .query import Database
+    db = Database()
+    objects = db.objects()
+
+    with FrameStoreWriter(args.output) as writer:
+        for obj in objects:
+            count = writer.append(obj.id, obj.iter_frames(args.directory))
+            if args.verbose:
+                print('%s: %d frames' % (obj.path, count))
+
+    if args.verbose:
+        print('%d videos stored at "%s"; set "%s" to use it' %
+              (len(objects), args.output, RC_KEY))
+
+    return 0
+
+
+def add_command(subparsers):
+    """Add specific subcommands that the action "materialize" can use"""
+
+    parser = subparsers.add_parser('materialize', help=materialize.__doc__)
+
+    parser.add_argument('-d', '--directory', required=True,
+                        help="The directory containing the original videos")
+    parser.add_argument('-o', '--output', required=True,
+                        help="The directory where the frame store is written")
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help="Print the number of frames of every video")
+
+    parser.set_defaults(func=materialize)  # action
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Opt-in instrumentation of the hot paths of the package.
+
+When enabled, :py:meth:`.File.load`, :py:meth:`.File.bbx`,
+:py:meth:`.Database.objects` and :py:meth:`.VerificationFile.load` record
+their wall time, the frames and bytes they return, their errors and cache
+hits. Recording is disabled by default and then costs a single flag check per
+call::
+
+  from bob.db.msu_mfsd_mod import metrics
+
+  with metrics.recording() as registry:
+      ...  # load some data
+  print(registry.prometheus())
+
+Use :py:meth:`Registry.subscribe` to be called after every instrumented call,
+e.g. to log the slow ones.
+"""
+
+import contextlib
+import functools
+import threading
+import time
+
+from .cache import video_cache
+from .decoding import decode_policy
+
+
+PREFIX = 'msu_mfsd_mod'
+"""The prefix of the metric names in the Prometheus text format"""
+
+_clock = getattr(time, 'perf_counter', time.time)  # Python 2 lacks perf_counter
+
+
+class Registry(object):
+    """Counters and timers of the instrumented calls.
+
+    Timers keep the number of calls, their total and their maximum wall time,
+    in seconds. Counters are plain sums.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.reset()
+
+    def reset(self):
+        """Sets all counters and timers back to zero"""
+        with self._lock:
+            self.counters = {}
+            self.timers = {}
+
+    def increment(self, name, value=1):
+        """Adds ``value`` to a counter, if recording is enabled"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds, **counts):
+        """Records one call of a timer, with additional counts (e.g. the
+        frames it returned) that are added to the ``<name>_<count>``
+        counters, then calls the subscribed callbacks"""
+        if not self.enabled:
+            return
+        with self._lock:
+            calls, total, longest = self.timers.get(name, (0, 0., 0.))
+            self.timers[name] = (calls + 1, total + seconds,
+                                 max(longest, seconds))
+            for key, value in counts.items():
+                key = '%s_%s' % (name, key)
+                self.counters[key] = self.counters.get(key, 0) + value
+        for callback in list(self._callbacks):
+            callback(name, seconds, counts)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Times the body of a ``with`` statement.
+
+        Yields a dictionary where the body may store counts, as given to
+        :py:meth:`observe`.
+        """
+        counts = {}
+        if not self.enabled:
+            yield counts
+            return
+        start = _clock()
+        try:
+            yield counts
+        except BaseException:
+            counts['errors'] = counts.get('errors', 0) + 1
+            raise
+        finally:
+            self.observe(name, _clock() - start, **counts)
+
+    def subscribe(self, callback):
+        """Registers ``callback(name, seconds, counts)``, called after every
+        instrumented call while recording"""
+        self._callbacks.append(callback)
+
+    def unsubscribe(self, callback):
+        """Removes a callback registered with :py:meth:`subscribe`"""
+        self._callbacks.remove(callback)
+
+    def snapshot(self):
+        """Returns all counters and timers, and the statistics of the video
+        cache and of the decode policy, as a dictionary"""
+        with self._lock:
+            timers = dict((name, {'calls': calls, 'seconds': total,
+                                  'max_seconds': longest})
+                          for name, (calls, total, longest)
+                          in self.timers.items())
+            counters = dict(self.counters)
+        return {
+            'timers': timers,
+            'counters': counters,
+            'video_cache': video_cache.stats(),
+            'decode_policy': decode_policy.stats(),
+        }
+
+    def prometheus(self):
+        """Returns the snapshot in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+        for name, timer in sorted(snapshot['timers'].items()):
+            metric = '%s_%s_seconds' % (PREFIX, name)
+            lines.append('# TYPE %s summary' % metric)
+            lines.append('%s_count %d' % (metric, timer['calls']))
+            lines.append('%s_sum %r' % (metric, timer['seconds']))
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = '%s_%s_total' % (PREFIX, name)
+            lines.append('# TYPE %s counter' % metric)
+            lines.append('%s %r' % (metric, value))
+        for group in ('video_cache', 'decode_policy'):
+            for name, value in sorted(snapshot[group].items()):
+                metric = '%s_%s_%s' % (PREFIX, group, name)
+                lines.append('# TYPE %s gauge' % metric)
+                lines.append('%s %r' % (metric, value))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+"""The registry of all instrumented calls of the package"""
+
+
+def stacked_frames(result):
+    """Counts the frames of a ``(N, ...)`` stack of frames"""
+    return len(result)
+
+
+def single_frame(result):
+    """Counts a single frame"""
+    return 1
+
+
+def instrument(name, frames=stacked_frames):
+    """Decorates a function so that its calls are timed in the
+    :py:data:`registry` under ``name``.
+
+    Arrays returned are counted as ``<name>_bytes``, and as
+    ``<name>_frames`` according to ``frames(result)``, e.g.
+    :py:func:`stacked_frames` or :py:func:`single_frame` (pass ``None`` if
+    the result is not made of frames). Lists returned are counted as
+    ``<name>_items``, and exceptions as ``<name>_errors``.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return func(*args, **kwargs)
+            with registry.timer(name) as counts:
+                result = func(*args, **kwargs)
+                if hasattr(result, 'nbytes'):
+                    if frames is not None:
+                        counts['frames'] = frames(result)
+                    counts['bytes'] = result.nbytes
+                elif isinstance(result, list):
+                    counts['items'] = len(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def enable():
+    """Starts recording"""
+    registry.enabled = True
+
+
+def disable():
+    """Stops recording, keeping what was recorded so far"""
+    registry.enabled = False
+
+
+@contextlib.contextmanager
+def recording(reset=True):
+    """Records the instrumented calls in the body of a ``with`` statement,
+    yielding the :py:data:`registry`"""
+    if reset:
+        registry.reset()
+    enabled, registry.enabled = registry.enabled, True
+    try:
+        yield registry
+    finally:
+        registry.enabled = enabled
@@ -4,19 +4,44 @@
 
 # from replay::models.py
 import os
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean
+import logging
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, Index
 from bob.db.base.sqlalchemy_migration import Enum, relationship
 import bob.db.base.utils
-from sqlalchemy.orm import backref
+from sqlalchemy.orm import backref, deferred
 from sqlalchemy.ext.declarative import declarative_base
 import numpy
-import bob.io.video
 from bob.db.base import File as BaseFile
-import bob.core
+from .framestore import get_store
+from . import faceindex
+from . import transform
+from . import faces
+from . import metrics
+from .utils import atomic_path
 
+# NOTE: the video codec stack (bob.io.video) and bob.io.base are only imported
+# when data is loaded or saved, since most users only need file lists.
 
 Base = declarative_base()
-logger = bob.core.log.setup('bob.db.msu_mfsd_mod')
+logger = logging.getLogger('bob.db.msu_mfsd_mod')
+_logger_is_set_up = False
+
+
+def _logger():
+  """Returns ``logger``, set up with ``bob.core.log.setup`` (its handlers and format, which the verbosity flags of the
+  command line tools rely on). bob.core is only imported before the first message, as most users never log anything."""
+  global _logger_is_set_up
+  if not _logger_is_set_up:
+    import bob.core
+    bob.core.log.setup('bob.db.msu_mfsd_mod')
+    _logger_is_set_up = True
+  return logger
+
+
+_face_directory = None
+
+HDF5_KEY = 'array'
+"""The HDF5 dataset written by :py:meth:`File.save`, as :py:func:`bob.io.base.save` does"""
 
 
 class Client(Base):
@@ -25,6 +50,12 @@ class Client(Base):
 
   __tablename__ = 'client'
 
+  # one covering index per fold, for the group filter of Database.objects()
+  # joined on the client id
+  __table_args__ = tuple(
+      Index('ix_client_fold%d_id' % k, 'client_fold%d' % k, 'id')
+      for k in range(1, 6))
+
   #  NOTE: the following 2 '_choices' tuples are only for information; they are not directly used for adding fields to the client-Table.
   group_choices = ('train', 'devel', 'test')
   fold_choices = ('fold1', 'fold2', 'fold3', 'fold4', 'fold5')
@@ -69,12 +100,110 @@ class Client(Base):
 # return "<Client(Id:'%s', Fold1:'%s', Fold2:'%s', Fold3:'%s', Fold4:'%s', Fold5:'%s')>" % (self.id, self.client_fold1, self.client_fold2, self.client_fold3, self.client_fold4, self.client_fold5)
 
 
+def frame_indices(frames, number_of_frames):
+  """Resolves a frame selection into a list of non-negative frame indices
+
+  Keyword parameters:
+  frames: A list of frame indices (negative values count from the end) or a :py:class:`slice`.
+  number_of_frames: The number of frames in the video, as announced by its container.
+
+  Returns a list of integers, in the requested order.
+  """
+
+  if isinstance(frames, slice):
+    return list(range(*frames.indices(number_of_frames)))
+
+  indices = []
+  for k in frames:
+    k = int(k)
+    if k < 0:
+      k += number_of_frames
+    if k < 0:
+      raise IndexError('frame index %d is out of range for a video with %d frames' % (k - number_of_frames, number_of_frames))
+    indices.append(k)
+  return indices
+
+
+def read_frames(reader, frames):
+  """Decodes only the selected frames of a video
+
+  The frame iterator of the reader is consumed up to the last requested frame,
+  so frames after it are never decoded, and frames that were not requested are
+  dropped as soon as they are decoded.
+
+  Keyword parameters:
+  reader: A :py:class:`bob.io.video.reader` for the video.
+  frames: A list of frame indices or a :py:class:`slice` (see :py:func:`frame_indices`).
+
+  Returns a :py:class:`numpy.ndarray` with shape ``(len(frames), 3, height, width)``.
+  """
+
+  indices = frame_indices(frames, reader.number_of_frames)
+  wanted = {}
+  for position, k in enumerate(indices):
+    wanted.setdefault(k, []).append(position)
+  if not wanted:
+    return numpy.empty((0, 3, reader.height, reader.width), dtype=numpy.uint8)
+  last = max(wanted)
+
+  vin = None
+  k = -1
+  for k, frame in enumerate(reader):
+    if vin is None:
+      vin = numpy.empty((len(indices),) + frame.shape, dtype=frame.dtype)
+    for position in wanted.get(k, ()):
+      vin[position] = frame
+    if k == last:
+      break  # before the next frame is decoded
+
+  if k < last:
+    raise IndexError('frame index %d is out of range for video "%s" with %d decoded frames' % (last, reader.filename, k + 1))
+
+  return vin
+
+
+def read_hdf5_frames(filename, frames, key=None):
+  """Reads only the selected entries of an HDF5 dataset saved with ``per_frame=True`` (see :py:meth:`File.save`)
+
+  Keyword parameters:
+  filename: The path to the HDF5 file.
+  frames: A list of entry indices or a :py:class:`slice` (see :py:func:`frame_indices`).
+  key: The dataset to read (defaults to the one written by :py:meth:`File.save`).
+
+  Returns a :py:class:`numpy.ndarray` with the selected entries stacked along the first dimension, or ``None`` if the
+  dataset was not saved per frame (or does not exist), in which case it must be read as a whole.
+  """
+
+  import bob.io.base
+  key = key or HDF5_KEY
+  hdf5 = bob.io.base.HDF5File(filename, 'r')
+  if not hdf5.has_key(key):
+    return None
+  size = hdf5.size(key)
+  if size <= 1:
+    return None
+  indices = frame_indices(frames, size)
+  if not indices:
+    return None
+  for k in indices:
+    if k >= size:
+      raise IndexError('entry %d is out of range for "%s" with %d entries' % (k, filename, size))
+  return numpy.array([hdf5.read(key, k) for k in indices])
+
+
 class File(Base, BaseFile):
   """Generic file container"""
 
   __tablename__ = 'file'
   # has fields: id, client_id, path, cls, rotate, quality, instrument
 
+  # the filters of Database.objects() on files, ordered as its "ORDER BY
+  # cls DESC, client.id", plus the join column; and the join column alone
+  __table_args__ = (
+      Index('ix_file_cls_quality_instrument_client', 'cls', 'quality', 'instrument', 'client_id'),
+      Index('ix_file_client', 'client_id'),
+  )
+
   quality_choices = ('laptop', 'mobile')
   """List of options for quality of device used for data-capture"""
 
@@ -84,6 +213,9 @@ class File(Base, BaseFile):
   presentation_choices = ('real', 'attack')
   """List of possible presentations """
 
+  frame_shapes = {'laptop': (3, 480, 640), 'mobile': (3, 480, 720)}
+  """Shape (channels, height, width) of the video frames, for each quality of device"""
+
 #  rotation_choices = (True, False)
 #  """Does the original video need to be rotated or not"""
 
@@ -108,11 +240,15 @@ class File(Base, BaseFile):
   instrument = Column(Enum(*instrument_choices), unique=False)
   """Attack-type"""
 
+  # deferred, since the databases created before this column do not have it;
+  # Database only loads it (with undefer) when the file table has the column
+  _number_of_frames = deferred(Column('number_of_frames', Integer, nullable=True))
+
   # for Python
   client = relationship(Client, backref=backref('files', order_by=id))
   """A direct link to the client object that this file belongs to"""
 
-  def __init__(self, fId, client, path, presentation, quality, atype, rotation=False):
+  def __init__(self, fId, client, path, presentation, quality, atype, rotation=False, number_of_frames=None):
     """Inputs other than 'self'
        fId: integer giving the file-id.
        client: integer giving the client-id
@@ -121,6 +257,7 @@ class File(Base, BaseFile):
        quality: string specifying 'laptop' or 'mobile'
        atype: string specifying 'video_hd', 'video_mobile', or 'print'
        rotation: bool: True if the file should be rotated upon load, otherwise False.
+       number_of_frames: integer giving the number of frames of the video, or None if unknown.
     """
     BaseFile.__init__(self, path, fId)
     self.client_id = client  # clientId
@@ -128,6 +265,18 @@ class File(Base, BaseFile):
     self.quality = quality  # laptop or mobile
     self.instrument = atype  # video_hd, video_mobile, or print
     self.rotate = rotation  # True or False
+    self.number_of_frames = number_of_frames
+
+  @property
+  def number_of_frames(self):
+    """Number of frames of the video, as announced by its container when the database was created (None if unknown, or
+    if the database predates this column)"""
+    # never triggers a query: unloaded means missing from the database
+    return self.__dict__.get('_number_of_frames')
+
+  @number_of_frames.setter
+  def number_of_frames(self, value):
+    self._number_of_frames = value
 
   def __repr__(self):
     return "<File('%s', '%s', '%s', '%s', '%s', '%s', '%s', )>" % (self.id, self.client_id, self.path, self.cls, self.quality, self.instrument, self.rotate)
@@ -195,14 +344,26 @@ class File(Base, BaseFile):
     Returns a string containing the face file path.
     """
     if not directory:
-      directory = self.get_file('face-locations')  # 'face-locations'
+      directory = self.face_directory()
     return self.make_path(directory, '.face')
 
-  def bbx(self, directory=None):
+  def face_directory(self):
+    """Returns the default directory of the face bounding-box files, which is only resolved once"""
+    global _face_directory
+    if _face_directory is None:
+      _face_directory = self.get_file('face-locations')
+    return _face_directory
+
+  @metrics.instrument('file_bbx', frames=None)
+  def bbx(self, directory=None, cache=False):
     """Reads the file containing the face locations for the frames in the current video
 
+    If the directory contains a face index (see :py:mod:`bob.db.msu_mfsd_mod.faceindex`), the face locations are returned as a
+    read-only view on the index, without parsing any text file.
+
     Keyword parameters:
     directory: A directory name that will be prepended to the final filepaths where the face bounding boxes are located, if not on the current directory.
+    cache: If ``True`` and there is no index, the parsed face locations are kept in memory (read-only) for the next calls.
 
     Returns:
       A :py:class:`numpy.ndarray` containing information about the located faces in the videos.
@@ -221,16 +382,24 @@ class File(Base, BaseFile):
       Note that **not** all the frames may contain detected faces.
     """
 
-    coords = numpy.loadtxt(self.facefile(directory), delimiter=',')
-    coords[:, 3] = coords[:, 3] - coords[:, 1]
-    coords[:, 4] = coords[:, 4] - coords[:, 2]
+    if not directory:
+      directory = self.face_directory()
+
+    index = faceindex.get_index(directory)
+    if index is not None and self.id in index:
+      metrics.registry.increment('file_bbx_index_hits')
+      return index.get(self.id)
 
-    return coords
+    return faceindex.load(self.facefile(directory), cache)
 
   def get_client_id(self):
     """The ID of the client. Value from 1 to 50. Clients in the train and devel set may have IDs from 1 to 20;
        clients in the test set have IDs from 21 to 50.
     """
+    # the integer id stored in the database is the number in the file stem;
+    # avoid parsing the path for every call
+    if isinstance(self.client_id, int):
+      return '%02d' % self.client_id
     # real_clientID_cameraType_resolution_scenario
     # attack_clientID_cameraType_resolution_attackType_scenario
     stem_file = os.path.basename(self.path)  # the file stem of the filename
@@ -264,7 +433,8 @@ class File(Base, BaseFile):
 
     return self.rotate  # True or False stored in this field
 
-  def load(self, directory=None, extension=None):
+  @metrics.instrument('file_load')
+  def load(self, directory=None, extension=None, frames=None, layout='chw', dtype=None, gray=False, contiguous=False, out=None):
     """Loads the data at the specified location and using the given extension.
 
     Keyword parameters:
@@ -273,6 +443,30 @@ class File(Base, BaseFile):
     directory: [optional] If not empty or None, this directory is prefixed to the final file destination
 
     extension: [optional] The extension of the filename - this will control the type of output and the codec for saving the input blob.
+
+    frames: [optional] A list of frame indices or a :py:class:`slice` selecting the frames to be returned, in the given order.
+      For videos, decoding stops right after the last requested frame and only the requested frames are kept in memory.
+      If not given, all frames are returned.
+
+    layout: [optional] ``'chw'`` (the default) returns ``(N, 3, height, width)`` frames, ``'hwc'`` returns
+      ``(N, height, width, 3)`` frames.
+
+    dtype: [optional] The type of the returned array, e.g. ``numpy.float32`` (values are not rescaled).
+
+    gray: [optional] If ``True``, the frames are converted to grayscale and the channel axis is dropped.
+
+    contiguous: [optional] If ``True``, a C-contiguous array is returned.
+
+    out: [optional] A preallocated array where the frames are written, see :py:func:`bob.db.msu_mfsd_mod.transform.output_shape`.
+
+    By default, the frames of videos recorded upside-down are returned as a rotated, non-contiguous view. Data read from
+    other files (e.g. ``.hdf5``) is never rotated. If any of
+    ``dtype``, ``gray``, ``contiguous`` or ``out`` is given, the rotation and the conversions are fused into a single copy
+    (see :py:func:`bob.db.msu_mfsd_mod.transform.convert`).
+
+    If a frame store is configured (see :py:mod:`bob.db.msu_mfsd_mod.framestore`) and contains this file, videos are not
+    decoded: a read-only :py:class:`numpy.memmap` of the already rotation-corrected frames is returned, and ``directory`` is
+    ignored.
     """
 
     if extension is None:
@@ -281,31 +475,139 @@ class File(Base, BaseFile):
         else:
             extension = '.mp4'
 
-    if extension == '.mov' or extension == '.mp4':
+    rotate = self.is_rotated()
+    store = get_store() if extension in ('.mov', '.mp4') else None
+    if store is not None and self.id in store:
+        vin = store.get(self.id)
+        if frames is not None:
+            vin = vin[frames]
+        rotate = False  # the store holds rotation-corrected frames
+        metrics.registry.increment('file_load_store_hits')
+    elif extension == '.mov' or extension == '.mp4':
+        import bob.io.video
         vfilename = self.make_path(directory, extension)
         video = bob.io.video.reader(vfilename)
-        vin = video.load()
+        if frames is None:
+            vin = video.load()
+        else:
+            vin = read_frames(video, frames)
     else:
-        vin = bob.io.base.load(self.make_path(directory, extension))
+        import bob.io.base
+        path = self.make_path(directory, extension)
+        vin = None
+        if frames is not None and extension == '.hdf5':
+            vin = read_hdf5_frames(path, frames)
+        if vin is None:
+            vin = bob.io.base.load(path)
+            if frames is not None:
+                vin = vin[frames]
+        # only the videos are recorded upside-down; other files (e.g.
+        # features) are returned as they were saved
+        rotate = False
+
+    _logger().debug('{} is_rotated: {}'.format(self, rotate))
+    return transform.convert(vin, rotate, layout, dtype, gray, contiguous, out)
+
+  def load_faces(self, directory=None, size=faces.DEFAULT_SIZE, frames=None, bbx_directory=None, extension=None):
+    """Loads the faces of the video, cropped with :py:meth:`bbx` and resized to a common size.
+
+    The video is decoded once, up to the last frame with a face, and all faces are cropped and resized (nearest neighbour)
+    in one vectorized operation, see :py:func:`bob.db.msu_mfsd_mod.faces.crop`.
 
-    logger.debug('{} is_rotated: {}'.format(self, self.is_rotated()))
-    if self.is_rotated():
-        vin = vin[:, :, ::-1, ::-1]
+    Keyword parameters:
+    directory: [optional] If not empty or None, this directory is prefixed to the path of the video.
+    size: [optional] The ``(height, width)`` of the returned faces.
+    frames: [optional] A list of frame indices or a :py:class:`slice` restricting the frames considered. Frames without a
+      detected face are always skipped.
+    bbx_directory: [optional] The directory of the face location files, passed to :py:meth:`bbx`.
+    extension: [optional] The extension of the video file, passed to :py:meth:`load`.
+
+    Returns a tuple ``(faces, numbers)``, with the ``(N, 3, height, width)`` faces and the ``N`` frame numbers they were
+    cropped from, in increasing order.
+    """
+
+    boxes = self.bbx(bbx_directory)
+    numbers = boxes[:, 0].astype(numpy.intp)
+    if frames is not None:
+      length = self.number_of_frames or (int(numbers.max()) + 1 if len(numbers) else 0)
+      keep = numpy.isin(numbers, frame_indices(frames, length))
+      boxes, numbers = boxes[keep], numbers[keep]
+
+    vin = self.load(directory, extension, frames=numbers.tolist())
+    return faces.crop(vin, boxes[:, 1:5], size), numbers
 
-    return vin
+  def iter_frames(self, directory=None, start=0, stop=None, step=1, extension=None):
+    """Iterates over the frames of the video, one frame at a time.
 
-  def save(self, data, directory=None, extension='.hdf5'):
+    Contrary to :py:meth:`load`, the full ``(N, 3, height, width)`` array is never built: frames are decoded one by one and
+    decoding stops once ``stop`` is reached. Frames of videos recorded upside-down are rotated by 180 degrees.
+
+    Keyword parameters:
+    directory: [optional] If not empty or None, this directory is prefixed to the final file destination
+    start, stop, step: [optional] Selects the frames to be yielded, with the same semantics as a :py:class:`slice`.
+      ``step`` must be positive.
+    extension: [optional] The extension of the video file. By default, it is derived from the quality of the recording.
+
+    Yields :py:class:`numpy.ndarray` objects with shape ``(3, height, width)``.
+    """
+
+    if step is None:
+      step = 1
+    if step <= 0:
+      raise ValueError('iter_frames() only supports positive steps, not %d' % step)
+
+    if extension is None:
+      extension = '.mov' if self.get_quality() == 'laptop' else '.mp4'
+
+    import bob.io.video
+    video = bob.io.video.reader(self.make_path(directory, extension))
+    indices = range(*slice(start, stop, step).indices(video.number_of_frames))
+    if not indices:
+      return
+    start, step, last = indices.start, indices.step, indices[-1]
+    rotate = self.is_rotated()
+
+    for k, frame in enumerate(video):
+      if k >= start and not (k - start) % step:
+        yield frame[:, ::-1, ::-1] if rotate else frame
+      if k == last:
+        break  # before the next frame is decoded
+
+  def save(self, data, directory=None, extension='.hdf5', compression=0, per_frame=False):
     """Saves the input data at the specified location and using the given extension.
 
+    The data is written to a temporary file next to the destination, which is then renamed, so the destination is either
+    complete or untouched.
+
     Keyword parameters:
     data: The data blob to be saved (normally a :py:class:`numpy.ndarray`).
     directory: If specified (not empty and not None), this directory is prefixed to the final file destination
     extension: The filename-extension - this determines the type of output and the codec for saving the input blob.
+    compression: [optional] The HDF5 compression level, from 0 (none, the default) to 9.
+    per_frame: [optional] If ``True``, every entry of the first dimension of ``data`` (e.g. every frame) is appended
+      separately to the HDF5 dataset, which stores each of them in its own chunk. :py:meth:`load` with ``frames`` then
+      only reads the selected entries.
     """
 
+    import bob.io.base
     path = self.make_path(directory, extension)
     bob.io.base.create_directories_safe(os.path.dirname(path))
-    bob.io.base.save(data, path)
+
+    if (compression or per_frame) and extension != '.hdf5':
+      raise ValueError("compression and per_frame are only supported for '.hdf5' files, not '%s'" % extension)
+
+    # an interrupted write never leaves a truncated file at the final path
+    with atomic_path(path) as tmpfile:
+      if compression or per_frame:
+        hdf5 = bob.io.base.HDF5File(tmpfile, 'w')
+        if per_frame:
+          for frame in data:
+            hdf5.append(HDF5_KEY, frame, compression)
+        else:
+          hdf5.set(HDF5_KEY, data, compression)
+        del hdf5  # closes the file
+      else:
+        bob.io.base.save(data, tmpfile)
 
 
 # # Intermediate mapping from RealAccess's to Protocol's
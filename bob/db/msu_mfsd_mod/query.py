@@ -7,15 +7,86 @@
 replay attack database in the most obvious ways.
 """
 
+import os
+import threading
 from bob.db.base import SQLiteDatabase
 from .models import File, Client
-from .driver import Interface
+from . import metrics
 from six import string_types
 
 
-INFO = Interface()
+# NOTE: resolved without pkg_resources (slow to import), like driver.files()
+SQLITE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db.sql3')
 
-SQLITE_FILE = INFO.files()[0]
+CLIENT_IDS = ('01', '02', '03', '05', '06', '07', '08', '09', '11', '12', '13', '14', '21', '22', '23', '24', '26', '28',
+              '29', '30', '32', '33', '34', '35', '36', '37', '39', '42', '48', '49', '50', '51', '53', '54', '55')
+"""All the client IDs in the database"""
+
+_worker = threading.local()
+
+
+def _load_in_worker(file_id, directory, extension, kwargs):
+  """Loads the data of one file inside a :py:meth:`Database.load_many` worker.
+
+  Every worker (thread or process) lazily opens its own session to the
+  database, since SQLite sessions cannot be shared between workers.
+  """
+  db = getattr(_worker, 'db', None)
+  if db is None:
+    db = _worker.db = Database()
+  f = db.query(File).options(*db._file_options()).filter(File.id == file_id).one()
+  return f.load(directory, extension, **kwargs)
+
+
+def _freeze(value):
+  """Normalises a query parameter into a hashable value"""
+  if value is None or isinstance(value, string_types):
+    return value
+  return tuple(sorted(value))
+
+
+class _MemoryIndex(object):
+  """A columnar, in-memory copy of the ``file`` and ``client`` tables.
+
+  Rows are kept in the order returned by :py:meth:`Database.objects` (reals
+  first, then by client id), so that selections are simple boolean masks.
+  """
+
+  def __init__(self, rows):
+    import numpy
+
+    cls = numpy.array([f.cls for f, _ in rows])
+    client = numpy.array([c.id for _, c in rows], dtype=int)
+    file_id = numpy.array([f.id for f, _ in rows], dtype=int)
+    # descending presentation class, then ascending client id (and file id,
+    # to make the order deterministic)
+    cls_rank = numpy.unique(cls, return_inverse=True)[1]
+    order = numpy.lexsort((file_id, client, -cls_rank))
+
+    self.files = [rows[k][0] for k in order]
+    self.cls = cls[order]
+    self.client = client[order]
+    self.quality = numpy.array([f.quality for f, _ in rows])[order]
+    self.instrument = numpy.array([f.instrument or '' for f, _ in rows])[order]
+    self.folds = dict(
+        (fold, numpy.array([getattr(c, 'client_' + fold) for _, c in rows])[order])
+        for fold in Client.fold_choices)
+
+  def select(self, quality, instrument, fold, group, cls, ids):
+    """Returns the files matching the (validated) parameters of
+    :py:meth:`Database.objects`"""
+    import numpy
+
+    mask = numpy.isin(self.folds[fold], list(group))
+    if ids:
+      mask &= numpy.isin(self.client, [int(k) for k in ids])
+    if cls:
+      mask &= numpy.isin(self.cls, list(cls))
+    if quality:
+      mask &= numpy.isin(self.quality, list(quality))
+    if instrument:
+      mask &= numpy.isin(self.instrument, list(instrument))
+    return [self.files[k] for k in numpy.flatnonzero(mask)]
 
 
 class Database(SQLiteDatabase):
@@ -25,11 +96,38 @@ class Database(SQLiteDatabase):
   and for the data itself inside the database.
   """
 
-  def __init__(self, original_directory=None, original_extension=None):
+  def __init__(self, original_directory=None, original_extension=None,
+               cache_queries=False, in_memory=False):
+    """Keyword parameters:
+
+    original_directory, original_extension
+      The directory and extension of the original data, see
+      :py:class:`bob.db.base.Database`.
+
+    cache_queries
+      If ``True``, the results of :py:meth:`objects` are memoized for each
+      distinct set of (validated) query parameters, and returned as lists of
+      :py:class:`.File` objects detached from the database session. The cache
+      is dropped whenever the SQLite file is modified.
+
+    in_memory
+      If ``True``, the ``client`` and ``file`` tables are read once into
+      numpy arrays, and :py:meth:`objects` is answered by boolean indexing over
+      them instead of SQL queries. The returned :py:class:`.File` objects are
+      detached from the database session.
+    """
     # opens a session to the database - keep it open until the end
     super(Database, self).__init__(SQLITE_FILE, File,
                                    original_directory, original_extension)
-
+    self.ids = list(CLIENT_IDS)
+    self.in_memory = in_memory
+    self._memory = None
+    self.cache_queries = cache_queries
+    self._query_cache = {}
+    self._query_cache_mtime = None
+    self._options = None
+
+  @metrics.instrument('database_objects')
   def objects(self, quality=File.quality_choices,
               instrument=File.instrument_choices,
               #                    protocol='grandtest',
@@ -81,8 +179,58 @@ class Database(SQLiteDatabase):
     Returns: A list of :py:class:`.File` objects.
     """
 
-    self.ids = ['01', '02', '03', '05', '06', '07', '08', '09', '11', '12', '13', '14', '21', '22', '23', '24', '26', '28',
-                '29', '30', '32', '33', '34', '35', '36', '37', '39', '42', '48', '49', '50', '51', '53', '54', '55']  # all the client IDs
+    quality, instrument, fold, group, cls, ids = self._check_parameters(
+        quality, instrument, fold, group, cls, ids)
+
+    key = None
+    if self.cache_queries:
+      key = (_freeze(quality), _freeze(instrument), fold, _freeze(group),
+             _freeze(cls), _freeze(ids))
+      files = self._cached_query(key)
+      if files is not None:
+        metrics.registry.increment('database_objects_cache_hits')
+        return files
+
+#    # check protocol validity
+#    if not protocol:
+#      protocol = 'grandtest'  # default
+#    VALID_PROTOCOLS = [k.name for k in self.protocols()]
+#    protocol = check_validity(protocol, "protocol", VALID_PROTOCOLS, ('grandtest',))
+#    # checks client identity validity
+#    VALID_CLIENTS = [k.id for k in self.clients()]
+#    clients = check_validity(clients, "client", VALID_CLIENTS, None)
+
+    if self.in_memory:
+      files = self._memory_index().select(quality, instrument, fold, group, cls, ids)
+      if key is not None:
+        self._query_cache[key] = files
+      return list(files)
+
+    # now query the database
+    retval = []
+
+    q = self._objects_query(quality, instrument, fold, group, cls, ids)
+    retval = list(q)
+
+    files = []
+    for r in retval:
+      f = r[0]
+      c = r[1]
+
+      f.client_id = c.id
+      f.client_fold = c.client_fold1
+      files.append(f)
+
+    if key is not None:
+      self._detach(retval)
+      self._query_cache[key] = files
+      return list(files)
+
+    return files
+
+  def _check_parameters(self, quality, instrument, fold, group, cls, ids):
+    """Validates the parameters of :py:meth:`objects`, replacing empty ones by
+    their defaults"""
 
     self.assert_validity()
 
@@ -128,20 +276,13 @@ class Database(SQLiteDatabase):
     VALID_IDS = self.ids
     ids = self.check_parameters_for_validity(ids, "id", VALID_IDS, VALID_IDS)
 
-#    # check protocol validity
-#    if not protocol:
-#      protocol = 'grandtest'  # default
-#    VALID_PROTOCOLS = [k.name for k in self.protocols()]
-#    protocol = check_validity(protocol, "protocol", VALID_PROTOCOLS, ('grandtest',))
-#    # checks client identity validity
-#    VALID_CLIENTS = [k.id for k in self.clients()]
-#    clients = check_validity(clients, "client", VALID_CLIENTS, None)
+    return quality, instrument, fold, group, cls, ids
 
-    # now query the database
-    retval = []
+  def _objects_query(self, quality, instrument, fold, group, cls, ids):
+    """Builds the SQL query of :py:meth:`objects` for validated parameters"""
 
 #    q = self.query(File, Client.id, Client.client_fold1).join(Client)
-    q = self.query(File, Client).join(Client)
+    q = self.query(File, Client).join(Client).options(*self._file_options())
 
     if ids:  # filter by id
       q = q.filter(Client.id.in_(ids))
@@ -161,7 +302,7 @@ class Database(SQLiteDatabase):
       q = q.filter(Client.client_fold5.in_(group))
     else:
       raise RuntimeError(
-          'Invalid Fold: "%s". Valid values are one string of %s' % (fold, VALID_FOLDS))
+          'Invalid Fold: "%s". Valid values are one string of %s' % (fold, self.folds()))
 
     if quality:
       q = q.filter(File.quality.in_(quality))
@@ -173,18 +314,219 @@ class Database(SQLiteDatabase):
     # first order by 'real' or 'attack' (desc() puts the 'reals' first),
     q = q.order_by(File.cls.desc()).order_by(Client.id)
 # and within each presentation, order by client-Id.
-    retval = list(q)
 
-    files = []
-    for r in retval:
-      f = r[0]
-      c = r[1]
+    return q
 
-      f.client_id = c.id
-      f.client_fold = c.client_fold1
-      files.append(f)
+  def explain(self, quality=File.quality_choices,
+              instrument=File.instrument_choices,
+              fold='fold1',
+              group=Client.group_choices,
+              cls=File.presentation_choices,
+              ids=[]):
+    """Returns the query plan of SQLite for a call to :py:meth:`objects`.
 
-    return files
+    Keyword parameters are the same as for :py:meth:`objects`.
+
+    Returns: a tuple ``(sql, plan)`` with the SQL statement and the list of
+    the lines of its plan, as reported by ``EXPLAIN QUERY PLAN``.
+    """
+
+    from sqlalchemy import text
+
+    q = self._objects_query(*self._check_parameters(
+        quality, instrument, fold, group, cls, ids))
+
+    sql = str(q.statement.compile(dialect=self.session.bind.dialect,
+                                  compile_kwargs={'literal_binds': True}))
+    plan = self.session.execute(text('EXPLAIN QUERY PLAN ' + sql))
+    return sql, [str(row[-1]) for row in plan]
+
+  def _file_options(self):
+    """Returns the query options loading the optional columns of the file
+    table, for those present in this database.
+
+    The ``number_of_frames`` column is missing from databases created by
+    older releases (e.g. the one fetched by ``download``); it is deferred in
+    the mapping, and only loaded when it exists.
+    """
+
+    if self._options is None:
+      from sqlalchemy import inspect
+      from sqlalchemy.orm import undefer
+      self.assert_validity()
+      columns = set(c['name'] for c in
+                    inspect(self.session.get_bind()).get_columns('file'))
+      self._options = [undefer(File._number_of_frames)] \
+          if 'number_of_frames' in columns else []
+    return self._options
+
+  def _cached_query(self, key):
+    """Returns a copy of the memoized result of a query, or ``None``"""
+
+    mtime = os.path.getmtime(SQLITE_FILE)
+    if mtime != self._query_cache_mtime:
+      self._query_cache.clear()
+      self._query_cache_mtime = mtime
+
+    files = self._query_cache.get(key)
+    return None if files is None else list(files)
+
+  def _detach(self, rows):
+    """Detaches the (file, client) rows of a query from the session"""
+
+    from sqlalchemy.orm.attributes import set_committed_value
+
+    for f, c in rows:
+      # keeps the relationship usable once detached
+      set_committed_value(f, 'client', c)
+      for obj in (f, c):
+        if obj in self.session:
+          self.session.expunge(obj)
+
+  def _memory_index(self):
+    """Returns the in-memory copy of the database, loading it if needed"""
+
+    if self._memory is None:
+      self.assert_validity()
+      rows = list(self.query(File, Client).join(Client)
+                  .options(*self._file_options()))
+      for f, c in rows:
+        f.client_id = c.id
+        f.client_fold = c.client_fold1
+      self._detach(rows)
+      self._memory = _MemoryIndex(rows)
+    return self._memory
+
+  def paths(self, files, directory=None, extension=None, joined=False):
+    """Returns the paths of many files at once, as :py:meth:`.File.make_path`
+    would for each of them.
+
+    Keyword parameters:
+
+    files
+      The :py:class:`.File` objects (or any objects with a ``path``), as
+      returned by :py:meth:`objects`.
+
+    directory, extension
+      Optionally prefixed and suffixed to every path.
+
+    joined
+      If ``True``, a single string is returned, with one path per line (and a
+      trailing newline), ready to be written at once.
+
+    Returns a :py:class:`numpy.ndarray` of strings, or a string.
+    """
+
+    prefix = os.path.join(directory, '') if directory else ''
+    extension = extension or ''
+    stems = [f.path for f in files]
+
+    if joined:
+      if not stems:
+        return ''
+      # one join builds the whole buffer, without an intermediate per path
+      return prefix + (extension + '\n' + prefix).join(stems) + extension + '\n'
+
+    import numpy
+    paths = numpy.array(stems, dtype=str)
+    if prefix:
+      paths = numpy.char.add(prefix, paths)
+    if extension:
+      paths = numpy.char.add(paths, extension)
+    return paths
+
+  def load_many(self, files, directory=None, extension=None, workers=None,
+                backend='thread', ordered=False, **kwargs):
+    """Loads the data of several files in parallel.
+
+    Keyword parameters:
+
+    files
+      The :py:class:`.File` objects to load, as returned by :py:meth:`objects`.
+
+    directory, extension
+      Passed to :py:meth:`.File.load` for every file.
+
+    workers
+      The number of parallel workers. Defaults to the number of CPUs. When set
+      to ``1``, the files are loaded sequentially in the calling thread.
+
+    backend
+      Either ``'thread'`` or ``'process'``. Each worker opens its own session
+      to the database. Note that the ``'process'`` backend pickles every loaded
+      array back to the calling process.
+
+    ordered
+      If ``True``, the results are yielded in the order of ``files``.
+      Otherwise (the default), they are yielded as soon as they are ready.
+
+    kwargs
+      Any other keyword argument (e.g. ``frames``, or the output layout
+      options ``layout``, ``dtype``, ``gray`` and ``contiguous``) is passed to
+      :py:meth:`.File.load`. A single ``out`` buffer cannot be shared by
+      several files, so it is not accepted.
+
+    Returns a generator of ``(file, data)`` tuples. At most ``2 * workers``
+    files are in flight at any time, so the memory use is bounded even if the
+    consumer is slower than the decoders. Invalid arguments are reported by
+    this call, not by the first iteration.
+    """
+
+    backend = self.check_parameter_for_validity(
+        backend, "backend", ('thread', 'process'), 'thread')
+    if 'out' in kwargs:
+      raise ValueError("load_many() does not accept an 'out' buffer")
+    if workers is None:
+      import multiprocessing
+      workers = multiprocessing.cpu_count()
+
+    return self._load_many(files, directory, extension, workers, backend,
+                           ordered, kwargs)
+
+  def _load_many(self, files, directory, extension, workers, backend, ordered,
+                 kwargs):
+    """The generator of :py:meth:`load_many`, with validated arguments"""
+
+    import collections
+    import concurrent.futures
+    import itertools
+
+    if workers <= 1:
+      for f in files:
+        yield f, f.load(directory, extension, **kwargs)
+      return
+
+    if backend == 'thread':
+      executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    else:
+      executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+    remaining = iter(files)
+    queue = collections.deque()  # (file, future), in submission order
+
+    def submit(n):
+      for f in itertools.islice(remaining, n):
+        queue.append((f, executor.submit(
+            _load_in_worker, f.id, directory, extension, kwargs)))
+
+    try:
+      submit(2 * workers)
+      while queue:
+        if ordered:
+          f, future = queue.popleft()
+        else:
+          done, _ = concurrent.futures.wait(
+              [k[1] for k in queue],
+              return_when=concurrent.futures.FIRST_COMPLETED)
+          f, future = next(k for k in queue if k[1] in done)
+          queue.remove((f, future))
+        data = future.result()
+        submit(1)
+        yield f, data
+    finally:
+      for _, future in queue:
+        future.cancel()
+      executor.shutdown(wait=True)
 
 #  def files(self, directory=None, extension=None, **object_query):
 #    """Returns a set of filenames for the specific query by the user.
@@ -7,9 +7,10 @@
 """
 
 import os
+import sys
 import unittest
 import pkg_resources
-from . import Database, File, VerificationDatabase
+from . import Database, File, VerificationDatabase, VideoCache
 # from nose.plugins.skip import SkipTest
 import bob.io.base
 import bob.io.video
@@ -31,6 +32,36 @@ class MFSDDatabaseTest(unittest.TestCase):
         from bob.db.base.script.dbmanage import main
         self.assertEqual(
             main('msu_mfsd_mod checkfiles --self-test'.split()), 0)
+        self.assertEqual(
+            main('msu_mfsd_mod checkfiles --verify -j 4 --self-test'.split()),
+            0)
+
+    def test13_explain(self):
+        from bob.db.base.script.dbmanage import main
+        self.assertEqual(main(
+            'msu_mfsd_mod explain -g train -c real -i 01 05 --self-test'.split()),
+            0)
+
+        sql, plan = Database().explain(fold='fold2', group='devel',
+                                       cls='attack', quality='mobile')
+        self.assertIn('client_fold2', sql)
+        self.assertTrue(plan)
+
+    def test14_paths(self):
+        db = Database()
+        files = db.objects(group='train')
+        expected = [f.make_path('/data', '.mov') for f in files]
+
+        paths = db.paths(files, '/data', '.mov')
+        self.assertEqual(list(paths), expected)
+        self.assertEqual(list(db.paths(files)), [f.path for f in files])
+        self.assertEqual(db.paths(files, '/data', '.mov', joined=True),
+                         ''.join(p + '\n' for p in expected))
+        self.assertEqual(db.paths([], joined=True), '')
+
+        for f in files:
+            stem = os.path.basename(f.path).split('_')[1]
+            self.assertEqual(f.get_client_id(), stem[-2:])
 
     def test04_manage_files(self):
 
@@ -163,6 +194,92 @@ class MFSDDatabaseTest(unittest.TestCase):
 # print 'upright video: SAD:', difsum2 #returns Inf on travis, but 0 (as it should be) on my machine.
 ##       self.assertTrue(np.array_equal(firstframe, reference_frame))
 
+    def test08_partial_load(self):
+        dbfolder = pkg_resources.resource_filename(__name__, 'test_images')
+        file1 = os.path.join('real', 'real_client005_android_SD_scene01')
+        thisobj = File('05', '005', file1, 'real', 'mobile', '', True)
+        vin = thisobj.load(dbfolder)
+
+        # only the requested frames are returned, rotated and in order
+        part = thisobj.load(dbfolder, frames=[3, 0, 3])
+        self.assertEqual(part.shape, (3,) + vin.shape[1:])
+        self.assertTrue(np.array_equal(part[0], vin[3]))
+        self.assertTrue(np.array_equal(part[1], vin[0]))
+        self.assertTrue(np.array_equal(part[2], vin[3]))
+
+        part = thisobj.load(dbfolder, frames=slice(2, 10, 4))
+        self.assertTrue(np.array_equal(part, vin[2:10:4]))
+
+        self.assertRaises(IndexError, thisobj.load, dbfolder,
+                          frames=[len(vin)])
+
+    def test09_iter_frames(self):
+        dbfolder = pkg_resources.resource_filename(__name__, 'test_images')
+        file1 = os.path.join('real', 'real_client005_android_SD_scene01')
+        thisobj = File('05', '005', file1, 'real', 'mobile', '', True)
+        vin = thisobj.load(dbfolder)
+
+        frames = list(thisobj.iter_frames(dbfolder))
+        self.assertEqual(len(frames), len(vin))
+        self.assertTrue(np.array_equal(frames[0], vin[0]))
+
+        frames = list(thisobj.iter_frames(dbfolder, 1, 9, 3))
+        self.assertEqual(len(frames), 3)
+        self.assertTrue(np.array_equal(np.array(frames), vin[1:9:3]))
+
+    def test10_load_many(self):
+        dbfolder = pkg_resources.resource_filename(__name__, 'test_images')
+        db = Database()
+        files = db.objects(ids=['05', '22'], cls='real', quality='mobile')
+        self.assertEqual(len(files), 2)
+
+        for backend in ('thread', 'process'):
+            loaded = list(db.load_many(files, dbfolder, workers=2,
+                                       backend=backend, ordered=True,
+                                       frames=[0]))
+            self.assertEqual([f.id for f, _ in loaded], [f.id for f in files])
+            for f, data in loaded:
+                self.assertTrue(np.array_equal(
+                    data, f.load(dbfolder, frames=[0])))
+
+        # invalid arguments are rejected by the call itself
+        self.assertRaises(ValueError, db.load_many, files, backend='gpu')
+        self.assertRaises(ValueError, db.load_many, files, out=np.empty(1))
+
+    def test11_query_cache(self):
+        db = Database(cache_queries=True)
+        fobj = db.objects(group='devel', fold='fold1', cls='attack')
+        self.assertEqual(len(fobj), 60)
+        # equivalent queries share the same cached objects
+        again = db.objects(group=('devel',), fold='fold1', cls=['attack'])
+        self.assertIsNot(fobj, again)
+        self.assertTrue(all(a is b for a, b in zip(fobj, again)))
+        # cached objects are detached but keep their client
+        self.assertTrue(all(f.client.id == f.client_id for f in fobj))
+        self.assertEqual(len(db.objects(group='train', fold='fold1',
+                                        cls='real')), 20)
+
+    def test12_in_memory(self):
+        db = Database()
+        memdb = Database(in_memory=True)
+        queries = [
+            {},
+            dict(fold='fold3', group='devel'),
+            dict(group='train', fold='fold1', cls='real'),
+            dict(group='test', fold='fold1', cls='attack', instrument='print',
+                 quality='mobile'),
+            dict(group='devel', ids=['01'], fold='fold1'),
+            dict(cls='attack', quality='laptop', ids=['05', '22', '55']),
+        ]
+        for query in queries:
+            expected = db.objects(**query)
+            result = memdb.objects(**query)
+            self.assertEqual(sorted(f.path for f in result),
+                             sorted(f.path for f in expected))
+            # same order by presentation and client (ties may differ)
+            self.assertEqual([(f.cls, f.client_id) for f in result],
+                             [(f.cls, f.client_id) for f in expected])
+
 
 def test_verification_protocol():
     db = VerificationDatabase(max_number_of_frames=3)
@@ -221,3 +338,771 @@ def test_verification_protocol():
             assert not f._f.is_real()
             assert 'attack' in f.client_id
             assert '{:02d}'.format(f._f.client_id) == client
+
+
+def test_video_cache():
+    cache = VideoCache(max_bytes=2 * 80)
+    loads = []
+
+    def loader(value):
+        def _load():
+            loads.append(value)
+            return np.full((10,), value, dtype='float64')
+        return _load
+
+    # sibling requests for the same key only decode once
+    for _ in range(3):
+        assert cache.get_or_load((1, None, None), loader(1))[0] == 1
+    assert loads == [1]
+    assert cache.hits == 2 and cache.misses == 1
+
+    # the byte budget holds two entries, the least recently used goes first
+    cache.get_or_load((2, None, None), loader(2))
+    cache.get_or_load((1, None, None), loader(1))
+    cache.get_or_load((3, None, None), loader(3))
+    assert (2, None, None) not in cache
+    assert (1, None, None) in cache
+    stats = cache.stats()
+    assert stats['entries'] == 2
+    assert stats['bytes'] == 160
+    assert stats['evictions'] == 1
+
+    # arrays larger than the budget are never cached
+    cache.resize(0)
+    assert len(cache) == 0
+    cache.get_or_load((1, None, None), loader(1))
+    assert len(cache) == 0
+
+
+def test_frame_store():
+    import tempfile
+    import shutil
+    from .framestore import FrameStoreWriter, FrameStore, set_store
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        video1 = np.random.randint(0, 256, (4, 3, 6, 8)).astype('uint8')
+        video2 = np.random.randint(0, 256, (2, 3, 8, 6)).astype('uint8')
+        with FrameStoreWriter(tmpdir) as writer:
+            assert writer.append(1, video1) == 4
+            # frames can also be streamed one by one
+            assert writer.append(2, iter(video2)) == 2
+
+        store = FrameStore(tmpdir)
+        assert len(store) == 2 and 1 in store and 3 not in store
+        assert np.array_equal(store.get(1), video1)
+        assert np.array_equal(store.get(2), video2)
+
+        # the store takes precedence over decoding; the video does not exist
+        set_store(tmpdir)
+        filename = os.path.join('real', 'real_client001_android_SD_scene01')
+        f = File(2, '001', filename, 'real', 'mobile', '', True)
+        assert np.array_equal(f.load('/does/not/exist'), video2)
+        assert np.array_equal(f.load(frames=[1]), video2[1:])
+    finally:
+        set_store(None)
+        shutil.rmtree(tmpdir)
+
+
+def test_face_index():
+    import tempfile
+    import shutil
+    from .faceindex import build, get_index
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        files = []
+        for k in (1, 2):
+            filename = os.path.join(
+                'real', 'real_client00%d_android_SD_scene01' % k)
+            f = File(k, '00%d' % k, filename, 'real', 'mobile', '')
+            if not os.path.exists(os.path.dirname(f.facefile(tmpdir))):
+                os.makedirs(os.path.dirname(f.facefile(tmpdir)))
+            with open(f.facefile(tmpdir), 'wt') as out:
+                for frame in range(3):
+                    out.write('%d,%d,10,%d,40\n' % (frame, k, k + 20))
+            files.append(f)
+
+        # without the index, text files are parsed
+        parsed = [f.bbx(tmpdir) for f in files]
+        assert np.array_equal(parsed[1][:, 3], [20, 20, 20])
+        assert np.array_equal(parsed[1][:, 4], [30, 30, 30])
+        cached = files[0].bbx(tmpdir, cache=True)
+        assert cached is files[0].bbx(tmpdir, cache=True)
+
+        build(files, tmpdir)
+        assert len(get_index(tmpdir)) == 2
+        for f, coords in zip(files, parsed):
+            view = f.bbx(tmpdir)
+            assert np.array_equal(view, coords)
+            assert not view.flags.writeable
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_lazy_imports():
+    # the video codec stack is only imported when videos are decoded
+    import subprocess
+    import sys
+    code = ('import sys, bob.db.msu_mfsd_mod; '
+            'print("bob.io.video" in sys.modules)')
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert output.decode().strip() == 'False'
+
+
+def test_parser_does_not_open_database():
+    import argparse
+    from . import query
+    from .driver import Interface
+
+    opened = []
+    original = query.Database.__init__
+
+    def init(self, *args, **kwargs):
+        opened.append(self)
+        original(self, *args, **kwargs)
+
+    query.Database.__init__ = init
+    try:
+        parser = argparse.ArgumentParser()
+        Interface().add_commands(parser.add_subparsers())
+    finally:
+        query.Database.__init__ = original
+    assert not opened
+
+
+def test_existing_paths():
+    import tempfile
+    import shutil
+    from .driver import existing_paths
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(tmpdir, 'real'))
+        present = os.path.join(tmpdir, 'real', 'a.mp4')
+        open(present, 'w').close()
+        paths = [present, os.path.join(tmpdir, 'real', 'b.mp4'),
+                 os.path.join(tmpdir, 'attack', 'c.mp4')]
+        assert existing_paths(paths, workers=2) == set([present])
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_verification_samples_are_reused():
+    db = VerificationDatabase(max_number_of_frames=3)
+    first = db.objects(protocol='grandtest-spoof', purposes='probe')
+    second = db.objects(protocol='grandtest-spoof', purposes='probe')
+    assert len(first) == len(second) == 3 * 35 * 6
+    assert [f.id for f in first] == [f.id for f in second]
+    assert len(set(f.id for f in first)) == len(first)
+
+    # the cached samples are not exposed to changes of the callers
+    for f in first:
+        f.client_id = 'model'
+    third = db.objects(protocol='grandtest-spoof', purposes='probe')
+    assert all(f.client_id.startswith('attack/') for f in third)
+    assert [f.client_id for f in second] == [f.client_id for f in third]
+
+
+def test_verification_file_attributes():
+    from .verificationprotocol import File as VFile
+    filename = os.path.join('attack', 'attack_client003_laptop_SD_ipad_video_scene01')
+    f = File(3, 3, filename, 'attack', 'laptop', 'video_hd')
+
+    sample = VFile(f, 7)
+    assert sample.path == filename + '_007'
+    assert sample.file_id == sample.id == '3_7'
+    assert sample.client_id == '03'
+    assert sample._f is f
+    assert sample.make_path('xxx', '.hdf5') == 'xxx/' + filename + '_007.hdf5'
+
+    # the attributes are plain, and can be assigned
+    sample.path, sample.id = 'other', 'other_7'
+    assert sample.make_path('xxx', '.hdf5') == 'xxx/other.hdf5'
+    assert sample.id == 'other_7'
+
+
+def test_verification_frame_indices():
+    from .verificationprotocol import selected_indices
+    db = VerificationDatabase(max_number_of_frames=3)
+    filename = os.path.join('real', 'real_client001_laptop_SD_scene01')
+    short = File(1, 1, filename, 'real', 'laptop', '', number_of_frames=90)
+    unknown = File(2, 1, filename, 'real', 'laptop', '')
+    assert list(db.frame_indices(short)) == selected_indices(90, 3)
+    assert max(db.frame_indices(short)) < 90
+    assert list(db.frame_indices(unknown)) == list(db.indices)
+
+
+def test_decode_policy():
+    from .decoding import DecodePolicy, DecodeError
+
+    policy = DecodePolicy(retries=2, backoff=0.001)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise IOError('stale NFS handle')
+        return 'video'
+
+    assert policy.run('a', flaky) == 'video'
+    assert len(calls) == 3
+
+    def broken():
+        calls.append(1)
+        raise RuntimeError('corrupt')
+
+    del calls[:]
+    for _ in range(2):
+        try:
+            policy.run('b', broken)
+            assert False, 'should have raised'
+        except DecodeError:
+            pass
+    # the second attempt fails fast, without decoding
+    assert len(calls) == 3
+    stats = policy.stats()
+    assert stats['successes'] == 1
+    assert stats['retries'] == 4
+    assert stats['failures'] == 1
+    assert stats['fast_failures'] == 1
+    assert stats['known_bad'] == 1
+
+    policy.forget('b')
+    assert policy.stats()['known_bad'] == 0
+
+
+def test_transform():
+    from .transform import convert, output_shape
+
+    frames = np.arange(2 * 3 * 4 * 5, dtype=np.uint8).reshape(2, 3, 4, 5)
+
+    # no conversion: the rotated view of the previous releases
+    view = convert(frames, rotate=True)
+    assert np.shares_memory(view, frames)
+    assert np.array_equal(view, frames[:, :, ::-1, ::-1])
+
+    # rotation and layout fused into one contiguous copy
+    hwc = convert(frames, rotate=True, layout='hwc', dtype=np.float32,
+                  contiguous=True)
+    assert hwc.shape == output_shape(frames.shape, 'hwc') == (2, 4, 5, 3)
+    assert hwc.dtype == np.float32 and hwc.flags.c_contiguous
+    assert np.array_equal(
+        hwc, frames[:, :, ::-1, ::-1].transpose(0, 2, 3, 1))
+
+    out = np.empty((2, 4, 5), dtype=np.uint8)
+    gray = convert(frames, gray=True, out=out)
+    assert gray is out
+    expected = np.rint(0.299 * frames[:, 0] + 0.587 * frames[:, 1] +
+                       0.114 * frames[:, 2])
+    assert np.abs(gray.astype(float) - expected).max() <= 1
+
+    for args, kwargs in ((frames, dict(out=out)),
+                         (frames, dict(layout='whc')),
+                         (frames[0, 0], dict(rotate=True))):
+        try:
+            convert(args, **kwargs)
+            assert False, 'should have raised'
+        except ValueError:
+            pass
+
+
+def test_face_crop():
+    from .faces import crop
+
+    frames = np.zeros((2, 3, 20, 30), dtype=np.uint8)
+    # a 4x6 block of ones, at x=10 and y=5 in the first frame
+    frames[0, :, 5:9, 10:16] = 1
+    # a 10x10 block of twos, at x=20 and y=10 in the second frame
+    frames[1, :, 10:20, 20:30] = 2
+    boxes = np.array([[10, 5, 6, 4], [20, 10, 10, 10]], dtype=float)
+
+    faces = crop(frames, boxes, size=(8, 8))
+    assert faces.shape == (2, 3, 8, 8)
+    assert faces.dtype == np.uint8
+    assert (faces[0] == 1).all()
+    assert (faces[1] == 2).all()
+
+    # boxes crossing the border are clamped to it
+    faces = crop(frames, np.array([[25, 15, 10, 10]] * 2), size=(4, 4))
+    assert (faces[1] == 2).all()
+
+
+def test_metrics():
+    from . import metrics
+
+    @metrics.instrument('dummy')
+    def load(n):
+        if n < 0:
+            raise ValueError(n)
+        return np.zeros((n, 3, 2, 2), dtype=np.uint8)
+
+    @metrics.instrument('frame', frames=metrics.single_frame)
+    def frame():
+        return np.zeros((3, 2, 2), dtype=np.uint8)
+
+    @metrics.instrument('boxes', frames=None)
+    def boxes():
+        return np.zeros((4, 5))
+
+    load(2)  # not recorded
+    assert not metrics.registry.timers
+
+    events = []
+    callback = lambda *args: events.append(args)
+    with metrics.recording() as registry:
+        registry.subscribe(callback)
+        load(2)
+        load(3)
+        try:
+            load(-1)
+        except ValueError:
+            pass
+        registry.increment('dummy_cache_hits')
+        frame()
+        boxes()
+    assert not metrics.registry.enabled
+
+    snapshot = registry.snapshot()
+    assert snapshot['timers']['dummy']['calls'] == 3
+    assert snapshot['counters'] == {
+        'dummy_frames': 5, 'dummy_bytes': 60, 'dummy_errors': 1,
+        'dummy_cache_hits': 1, 'frame_frames': 1, 'frame_bytes': 12,
+        'boxes_bytes': 160}
+    assert 'hits' in snapshot['video_cache']
+    assert 'failures' in snapshot['decode_policy']
+    assert [e[0] for e in events] == ['dummy'] * 3 + ['frame', 'boxes']
+
+    text = registry.prometheus()
+    assert 'msu_mfsd_mod_dummy_seconds_count 3\n' in text
+    assert 'msu_mfsd_mod_dummy_frames_total 5\n' in text
+    registry.unsubscribe(callback)
+    registry.reset()
+
+
+def test_save_per_frame():
+    import tempfile
+    import shutil
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        f = File(1, 1, 'real/real_client001_laptop_SD_scene01', 'real',
+                 'laptop', '')
+        data = np.arange(5 * 2 * 3, dtype=np.float64).reshape(5, 2, 3)
+        f.save(data, tmpdir, compression=6, per_frame=True)
+        # nothing but the final file is left behind
+        assert os.listdir(os.path.dirname(f.make_path(tmpdir))) == [
+            os.path.basename(f.make_path(tmpdir, '.hdf5'))]
+
+        assert np.array_equal(f.load(tmpdir, '.hdf5'), data)
+        assert np.array_equal(f.load(tmpdir, '.hdf5', frames=[4, 1]),
+                              data[[4, 1]])
+        assert np.array_equal(f.load(tmpdir, '.hdf5', frames=slice(1, 3)),
+                              data[1:3])
+
+        # unchunked files are read as a whole
+        f.save(data, tmpdir)
+        assert np.array_equal(f.load(tmpdir, '.hdf5', frames=[4, 1]),
+                              data[[4, 1]])
+
+        # only videos are rotated, not the data saved for rotated files
+        rotated = File(2, 2, 'real/real_client002_laptop_SD_scene01', 'real',
+                       'laptop', '', rotation=True)
+        features = data.reshape(5, 6)
+        rotated.save(features, tmpdir, per_frame=True)
+        assert np.array_equal(rotated.load(tmpdir, '.hdf5'), features)
+        assert np.array_equal(rotated.load(tmpdir, '.hdf5', frames=[4, 1]),
+                              features[[4, 1]])
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_feature_cache():
+    import tempfile
+    import shutil
+    from .features import FeatureCache, parse_size
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        files = [File(k, k, 'real/real_client%03d_laptop_SD_scene01' % k,
+                      'real', 'laptop', '', rotation=bool(k % 2))
+                 for k in (1, 2, 3)]
+        params = {'radius': 1, 'neighbors': 8}
+        cache = FeatureCache(tmpdir)
+        for f in files:
+            cache.put(f, 'lbp', params, np.arange(4.) * f.id)
+            assert cache.contains(f, 'lbp', params)
+            assert not cache.contains(f, 'lbp', {'radius': 2})
+
+        # the manifest is shared, and the key order of params is irrelevant
+        other = FeatureCache(tmpdir)
+        assert len(other) == 3
+        features = other.get(files[0], 'lbp', {'neighbors': 8, 'radius': 1})
+        assert np.array_equal(features, np.arange(4.))
+        computed = other.get_or_compute(files[1], 'lbp', {'radius': 2},
+                                        lambda: np.ones(4))
+        assert np.array_equal(computed, np.ones(4))
+        assert len(other) == 4
+
+        # the least recently used entries are removed first
+        other.flush()
+        size = other.size() // 4
+        assert other.prune(2 * size) == 2
+        assert other.get(files[0], 'lbp', params) is not None
+        assert other.get(files[2], 'lbp', params) is None
+        assert len(FeatureCache(tmpdir)) == 2
+
+        assert parse_size('20G') == 20 * 1024 ** 3
+        assert parse_size('512') == 512
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_async_prefetch():
+    # the coroutines are driven with run_until_complete(), so that this module
+    # remains valid Python 2 syntax
+    if sys.version_info < (3, 6):
+        raise unittest.SkipTest('the asyncio interface requires Python 3.6')
+    import asyncio
+    import threading
+    import time
+    from .aio import AsyncDatabase, load
+
+    lock = threading.Lock()
+    running = [0, 0]  # current, maximum
+
+    class Dummy(object):
+        def __init__(self, k):
+            self.k = k
+
+        def load(self, directory=None, extension=None):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+            return self.k * 10
+
+    loop = asyncio.new_event_loop()
+    db = AsyncDatabase(workers=4, max_concurrency=2)
+    try:
+        assert loop.run_until_complete(load(Dummy(3))) == 30
+
+        results = []
+        prefetch = db.prefetch([Dummy(k) for k in range(8)])
+        while True:
+            try:
+                results.append(loop.run_until_complete(prefetch.__anext__()))
+            except StopAsyncIteration:
+                break
+
+        # closing the generator early cancels the pending loads
+        prefetch = db.prefetch([Dummy(k) for k in range(8)])
+        loop.run_until_complete(prefetch.__anext__())
+        loop.run_until_complete(prefetch.aclose())
+    finally:
+        db.close()
+        loop.close()
+    assert [(f.k, data) for f, data in results] == \
+        [(k, k * 10) for k in range(8)]
+    assert running[1] <= 2
+
+
+def _create_database(filename):
+    """Builds the database into ``filename`` with the create command"""
+    import argparse
+    from .create import create
+
+    # create reads its lists relative to the root of the source tree
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir, os.pardir, os.pardir)
+    cwd = os.getcwd()
+    try:
+        os.chdir(root)
+        create(argparse.Namespace(recreate=True, verbose=0, type='sqlite',
+                                  directory=None, files=[filename]))
+    finally:
+        os.chdir(cwd)
+
+
+def test_database_without_frame_counts():
+    # databases created by older releases have no number_of_frames column
+    import sqlite3
+    import tempfile
+    import shutil
+    from . import query
+
+    tmpdir = tempfile.mkdtemp()
+    original = query.SQLITE_FILE
+    try:
+        query.SQLITE_FILE = os.path.join(tmpdir, 'db.sql3')
+        _create_database(query.SQLITE_FILE)
+        # rebuilds the file table with the schema of those releases (DROP
+        # COLUMN needs SQLite 3.35)
+        connection = sqlite3.connect(query.SQLITE_FILE)
+        connection.executescript("""
+            ALTER TABLE file RENAME TO current_file;
+            CREATE TABLE file (
+                id INTEGER NOT NULL,
+                client_id INTEGER,
+                path VARCHAR(200),
+                cls VARCHAR(6),
+                rotate BOOLEAN,
+                quality VARCHAR(6),
+                instrument VARCHAR(12),
+                PRIMARY KEY (id),
+                UNIQUE (path),
+                FOREIGN KEY(client_id) REFERENCES client (id)
+            );
+            INSERT INTO file
+                SELECT id, client_id, path, cls, rotate, quality, instrument
+                FROM current_file;
+            DROP TABLE current_file;
+        """)
+        connection.commit()
+        connection.close()
+
+        for options in ({}, {'in_memory': True}):
+            files = Database(**options).objects(group='train')
+            assert len(files) > 0
+            assert all(f.number_of_frames is None for f in files)
+        db = VerificationDatabase(max_number_of_frames=3)
+        f = db._db.objects(cls='real')[0]
+        assert list(db.frame_indices(f)) == list(db.indices)
+    finally:
+        query.SQLITE_FILE = original
+        shutil.rmtree(tmpdir)
+
+
+def _put_features(arguments):
+    from .features import FeatureCache
+    directory, first = arguments
+    cache = FeatureCache(directory)
+    for k in range(first, first + 10):
+        f = File(k, 1, 'real/real_client001_laptop_SD_scene%02d' % k, 'real',
+                 'laptop', '')
+        cache.put(f, 'lbp', None, np.ones(2))
+
+
+def test_feature_cache_processes():
+    # concurrent writers must not drop each other's manifest entries
+    import multiprocessing
+    import tempfile
+    import shutil
+    from .features import FeatureCache
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        pool = multiprocessing.Pool(2)
+        try:
+            pool.map(_put_features, [(tmpdir, 1), (tmpdir, 11)])
+        finally:
+            pool.close()
+            pool.join()
+        assert len(FeatureCache(tmpdir)) == 20
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_feature_cache_shared_prune():
+    # entries pruned by one instance are not resurrected by another one
+    import tempfile
+    import shutil
+    from .features import FeatureCache
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        files = [File(k, 1, 'real/real_client001_laptop_SD_scene%02d' % k,
+                      'real', 'laptop', '') for k in (1, 2, 3, 4)]
+        first = FeatureCache(tmpdir)
+        for f in files[:3]:
+            first.put(f, 'lbp', None, np.ones(2))
+        second = FeatureCache(tmpdir)
+        assert second.get(files[0], 'lbp') is not None
+        assert first.prune(0) == 3
+
+        # the next write of the second instance drops the pruned entries
+        second.put(files[3], 'lbp', None, np.ones(2))
+        second.flush()
+        for f in files[:3]:
+            assert not second.contains(f, 'lbp')
+        assert len(second) == 1
+        reloaded = FeatureCache(tmpdir)
+        assert len(reloaded) == 1
+        assert second.size() == reloaded.size()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+class _CountingReader(object):
+    """A stand-in for bob.io.video.reader, counting the decoded frames"""
+
+    def __init__(self, number_of_frames):
+        self.number_of_frames = number_of_frames
+        self.height, self.width = 2, 2
+        self.filename = 'dummy.mov'
+        self.decoded = 0
+
+    def __iter__(self):
+        for k in range(self.number_of_frames):
+            self.decoded += 1
+            yield np.full((3, 2, 2), k, dtype=np.uint8)
+
+
+def test_read_frames_stops_at_last():
+    from .models import read_frames
+
+    reader = _CountingReader(10)
+    frames = read_frames(reader, [0])
+    assert frames.shape == (1, 3, 2, 2) and (frames == 0).all()
+    assert reader.decoded == 1
+
+    reader = _CountingReader(10)
+    frames = read_frames(reader, [4, 2])
+    assert [f[0, 0, 0] for f in frames] == [4, 2]
+    assert reader.decoded == 5
+
+    reader = _CountingReader(10)
+    assert read_frames(reader, []).shape == (0, 3, 2, 2)
+    assert reader.decoded == 0
+
+
+def test_iter_frames_stops_at_last():
+    # bob.io.video.reader is replaced by hand, as unittest.mock is not
+    # available on Python 2
+    original = bob.io.video.reader
+    f = File(1, 1, 'real/real_client001_laptop_SD_scene01', 'real', 'laptop',
+             '')
+    try:
+        reader = _CountingReader(10)
+        bob.io.video.reader = lambda filename: reader
+        frames = list(f.iter_frames(start=1, stop=8, step=3))
+        assert [k[0, 0, 0] for k in frames] == [1, 4, 7]
+        assert reader.decoded == 8
+
+        reader = _CountingReader(10)
+        assert list(f.iter_frames(start=5, stop=5)) == []
+        assert reader.decoded == 0
+    finally:
+        bob.io.video.reader = original
+
+
+def test_face_store_is_not_a_frame_store():
+    import tempfile
+    import shutil
+    from . import framestore
+    from .framestore import FrameStore, FrameStoreWriter, set_store, get_store
+    from .faces import STORE_INDEX
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with FrameStoreWriter(tmpdir, STORE_INDEX) as writer:
+            writer.append(1, np.zeros((2, 3, 4, 4), dtype=np.uint8))
+        assert 1 in FrameStore(tmpdir, STORE_INDEX)
+        assert not os.path.exists(os.path.join(tmpdir, framestore.INDEX_FILENAME))
+
+        # a frame store configured there is not found
+        from bob.extension import rc
+        original = rc.get(framestore.RC_KEY)
+        framestore._store = None
+        try:
+            rc[framestore.RC_KEY] = tmpdir
+            assert get_store() is None
+        finally:
+            if original is None:
+                del rc[framestore.RC_KEY]
+            else:
+                rc[framestore.RC_KEY] = original
+            set_store(None)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_face_store_round_trip():
+    # the faces command keeps the frame numbers the crops were sampled at
+    import argparse
+    import tempfile
+    import shutil
+    from . import query
+    from .faces import FaceStore, crop, faces
+
+    frames = (np.arange(5 * 3 * 20 * 30) % 251).astype(np.uint8)
+    frames = frames.reshape(5, 3, 20, 30)
+    boxes = np.array([[2, 3, 10, 8], [5, 1, 12, 12]], dtype=float)
+    numbers = np.array([1, 4])
+
+    class Video(object):
+        id = 7
+        path = 'real/real_client001_laptop_SD_scene01'
+
+        def load_faces(self, directory, size, bbx_directory=None):
+            return crop(frames[numbers], boxes, size), numbers
+
+    class Objects(object):
+        def objects(self):
+            return [Video()]
+
+    tmpdir = tempfile.mkdtemp()
+    Database, query.Database = query.Database, Objects
+    try:
+        args = argparse.Namespace(directory='', bbx_directory=None,
+                                  output=tmpdir, size=(6, 4), format='store',
+                                  verbose=0)
+        assert faces(args) == 0
+        crops, stored = FaceStore(tmpdir).get_faces(7)
+        assert crops.shape == (2, 3, 6, 4)
+        assert np.array_equal(crops, crop(frames[numbers], boxes, (6, 4)))
+        assert np.array_equal(stored, numbers)
+    finally:
+        query.Database = Database
+        shutil.rmtree(tmpdir)
+
+
+def test_create_matches_shipped_database():
+    import sqlite3
+    import tempfile
+    import shutil
+    from . import query
+
+    def rows(filename):
+        connection = sqlite3.connect(filename)
+        try:
+            clients = sorted(connection.execute(
+                'SELECT id, client_fold1, client_fold2, client_fold3, '
+                'client_fold4, client_fold5 FROM client'))
+            files = dict((r[0], r[1:]) for r in connection.execute(
+                'SELECT path, client_id, cls, rotate, quality, instrument '
+                'FROM file'))
+            indexes = set(r[0] for r in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index'"))
+        finally:
+            connection.close()
+        return clients, files, indexes
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'db.sql3')
+        _create_database(filename)
+        clients, files, indexes = rows(filename)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    shipped_clients, shipped_files, _ = rows(query.SQLITE_FILE)
+    assert clients == shipped_clients
+    assert files == shipped_files
+    assert len(files) == 280
+
+    # the enums and the rotation flags hold the values of the ORM
+    assert set(f[1] for f in files.values()) == set(File.presentation_choices)
+    assert set(f[3] for f in files.values()) == set(File.quality_choices)
+    assert set(f[4] for f in files.values()) <= set(File.instrument_choices)
+    rotated = pkg_resources.resource_filename(
+        __name__, os.path.join('rotated_videos', 'rotated_videos.txt'))
+    with open(rotated) as f:
+        expected = set(line.strip() for line in f if line.strip())
+    assert set(p for p, f in files.items() if f[2]) == expected
+
+    assert set(['ix_client_fold%d_id' % k for k in range(1, 6)] +
+               ['ix_file_cls_quality_instrument_client',
+                'ix_file_client']) <= indexes
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Fused rotation and layout conversion of decoded frames.
+
+The decoders return frames as ``uint8`` ``(..., 3, height, width)`` arrays,
+and videos recorded upside-down are rotated by a negative-stride view. Every
+consumer that needs a contiguous, channels-last, floating-point or grayscale
+array would copy that view again. :py:func:`convert` applies the rotation and
+all conversions while writing a single output array.
+"""
+
+import numpy
+
+
+LAYOUTS = ('chw', 'hwc')
+"""The supported frame layouts: channels first (as decoded), or last"""
+
+GRAY_WEIGHTS = (0.299, 0.587, 0.114)
+"""The weights of the red, green and blue channels in the grayscale
+conversion (ITU-R BT.601, as in ``bob.ip.color.rgb_to_gray``)"""
+
+
+def output_shape(shape, layout='chw', gray=False):
+    """Returns the shape of the converted array, for an input of the given
+    ``(..., 3, height, width)`` shape."""
+    if gray:
+        return tuple(shape[:-3]) + tuple(shape[-2:])
+    if layout == 'hwc':
+        return tuple(shape[:-3]) + tuple(shape[-2:]) + (shape[-3],)
+    return tuple(shape)
+
+
+def convert(frames, rotate=False, layout='chw', dtype=None, gray=False,
+            contiguous=False, out=None):
+    """Rotates and converts frames, copying them at most once.
+
+    Parameters:
+
+      frames (numpy.ndarray): The ``(..., 3, height, width)`` frames, e.g. a
+        video or a single frame.
+
+      rotate (bool): Whether to rotate the frames by 180 degrees.
+
+      layout (str): ``'chw'`` for channels first (the default, as decoded) or
+        ``'hwc'`` for channels last.
+
+      dtype: The type of the returned array. Defaults to the type of ``out``,
+        or to the type of ``frames``. Values are not rescaled, e.g. floating
+        point frames range from 0 to 255.
+
+      gray (bool): Whether to convert the frames to grayscale. The channel
+        axis is then dropped and ``layout`` has no effect.
+
+      contiguous (bool): Whether the returned array must be C-contiguous.
+
+      out (numpy.ndarray): A preallocated array, of shape
+        :py:func:`output_shape`, where the result is written.
+
+    Returns a view on ``frames`` if no copy is required, that is if neither
+    ``contiguous``, ``gray``, ``out`` nor a different ``dtype`` is requested.
+    Otherwise, returns a new C-contiguous array, or ``out``.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError('layout must be one of %s, not %r' % (LAYOUTS, layout))
+
+    if rotate:
+        if frames.ndim < 3:
+            raise ValueError('only (..., 3, height, width) frames can be '
+                             'rotated, not arrays of shape %s' %
+                             (frames.shape,))
+        frames = frames[..., ::-1, ::-1]
+    if dtype is None:
+        dtype = frames.dtype if out is None else out.dtype
+    dtype = numpy.dtype(dtype)
+
+    if not gray and layout == 'hwc':
+        frames = numpy.moveaxis(frames, -3, -1)
+
+    if out is None and not gray and dtype == frames.dtype and (
+            not contiguous or frames.flags.c_contiguous):
+        return frames
+
+    shape = output_shape(frames.shape, 'chw', gray)
+    if out is None:
+        out = numpy.empty(shape, dtype=dtype)
+    elif out.shape != shape or out.dtype != dtype:
+        raise ValueError('out has shape %s and type %s, expected %s and %s' %
+                         (out.shape, out.dtype, shape, dtype))
+
+    if gray:
+        _to_gray(frames, out)
+    else:
+        numpy.copyto(out, frames, casting='unsafe')
+    return out
+
+
+def _to_gray(frames, out):
+    """Writes the weighted sum of the channels of ``frames`` into ``out``"""
+    if out.dtype == numpy.float32:
+        acc = out
+    else:
+        acc = numpy.empty(out.shape, dtype=numpy.float32)
+    weights = numpy.array(GRAY_WEIGHTS, dtype=numpy.float32)
+    numpy.multiply(frames[..., 0, :, :], weights[0], out=acc,
+                   dtype=numpy.float32)
+    for channel in (1, 2):
+        acc += weights[channel] * frames[..., channel, :, :]
+    if acc is not out:
+        if numpy.issubdtype(out.dtype, numpy.integer):
+            numpy.rint(acc, out=acc)
+        numpy.copyto(out, acc, casting='unsafe')
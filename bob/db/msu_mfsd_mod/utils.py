@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Atomic file writes, shared by :py:meth:`.File.save`, the feature cache and
+the face extraction.
+
+A file is written under a temporary name next to its destination, then moved
+in place, so that readers see either the complete file or none at all::
+
+  with atomic_path(path) as tmpfile:
+      numpy.save(tmpfile, data)
+"""
+
+import contextlib
+import os
+
+
+if hasattr(os, 'replace'):
+    replace = os.replace
+else:
+    # Python 2: os.rename overwrites the destination atomically on POSIX
+    replace = os.rename
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """Yields a temporary file name next to ``path``, with the same
+    extension (which selects the codec of :py:func:`bob.io.base.save`).
+
+    The temporary file is moved to ``path`` when the body of the ``with``
+    statement succeeds, and removed if it raises.
+    """
+    root, extension = os.path.splitext(path)
+    tmpfile = '%s.%d.tmp%s' % (root, os.getpid(), extension)
+    try:
+        yield tmpfile
+        replace(tmpfile, path)
+    except BaseException:
+        if os.path.exists(tmpfile):
+            os.unlink(tmpfile)
+        raise
@@ -7,9 +7,15 @@ for verification experiments (good to use in the bob.bio.base framework). It
 also implements a kind of hack so that you can run vulnerability analysis with
 it. """
 
+import copy
+
 from bob.db.base import File as BaseFile
 from bob.db.base import Database as BaseDatabase
 from .query import Database as LDatabase
+from .cache import video_cache
+from .decoding import decode_policy
+from .framestore import get_store
+from . import metrics
 
 
 def selected_indices(total_number_of_indices, desired_number_of_indices=None):
@@ -41,17 +47,26 @@ class File(BaseFile):
         self.file_id = '{}_{}'.format(f.id, framen)
         super(File, self).__init__(path=self.path, file_id=self.file_id)
 
+    @metrics.instrument('verification_load', frames=metrics.single_frame)
     def load(self, directory=None, extension=None):
         if extension in (None, '.mov', '.mp4'):
             # the extension is dynamic; the low-level knows about it.
             extension = None
-            for i in range(100):
-                try:
-                    video = self._f.load(directory, extension)
-                    # just return the required frame.
-                    return video[self.framen]
-                except RuntimeError:
-                    pass
+            store = get_store()
+            if store is not None and self._f.id in store:
+                # zero-copy, read-only view of the pre-decoded frame
+                metrics.registry.increment('verification_load_store_hits')
+                return store.get(self._f.id)[self.framen]
+            # sibling frames of the same video share a single decode;
+            # transient failures are retried, known-bad files fail fast
+            key = (self._f.id, directory, extension)
+            if key in video_cache:
+                metrics.registry.increment('verification_load_cache_hits')
+            video = video_cache.get_or_load(key, lambda: decode_policy.run(
+                key, lambda: self._f.load(directory, extension)))
+            # just return the required frame (a copy, so the cached video
+            # cannot be modified by the caller).
+            return video[self.framen].copy()
         else:
             return super(File, self).load(directory, extension)
 
@@ -62,19 +77,32 @@ class Database(BaseDatabase):
     This database loads max_number_of_frames from the video files as
     separate samples. This is different from what bob.bio.video does
     currently.
+
+    Decoded videos are kept in the shared
+    :py:data:`bob.db.msu_mfsd_mod.cache.video_cache`, so that all frame
+    samples of one video are served from a single decode. Set
+    ``cache_bytes`` to change its memory budget (``0`` disables it).
     """
     __doc__ = __doc__
 
     def __init__(self, max_number_of_frames=10,
-                 original_directory=None, original_extension=None):
+                 original_directory=None, original_extension=None,
+                 cache_bytes=None):
         super(Database, self).__init__(original_directory, original_extension)
 
-        # call base class constructors to open a session to the database
-        self._db = LDatabase()
+        if cache_bytes is not None:
+            video_cache.resize(cache_bytes)
+
+        # call base class constructors to open a session to the database;
+        # the same low-level queries are repeated for every model id
+        self._db = LDatabase(cache_queries=True)
 
         self.max_number_of_frames = max_number_of_frames or 10
-        # 180 is the guaranteed number of frames in msu mfsd videos
+        # 180 is the guaranteed number of frames in msu mfsd videos; used
+        # for files whose real number of frames is not in the database
         self.indices = selected_indices(180, self.max_number_of_frames)
+        # the frame samples of every video, by low-level file id
+        self._samples = {}
         self.low_level_group_names = ('train', 'devel', 'test')
         self.high_level_group_names = ('world', 'dev', 'eval')
 
@@ -146,14 +174,32 @@ class Database(BaseDatabase):
                                    cls=classes, ids=model_ids, **kwargs)
 
         # make sure to return File representation of a file, not the database
-        # one also make sure you replace client ids with attack
+        # one (the frame samples of each video are only built once)
         retval = []
         for f in objects:
-            for i in self.indices:
-                if f.is_real():
-                    retval.append(File(f, i))
-                else:
-                    temp = File(f, i)
-                    temp.client_id = 'attack/{}'.format(f.instrument)
-                    retval.append(temp)
+            retval.extend(self._frame_samples(f))
         return retval
+
+    def frame_indices(self, f):
+        """Returns the indices of the frames used as samples for a low-level
+        file, evenly spread over the real length of its video when it is known
+        from the database"""
+        if not f.number_of_frames:
+            return self.indices
+        return selected_indices(f.number_of_frames, self.max_number_of_frames)
+
+    def _frame_samples(self, f):
+        """Returns the frame samples of a low-level file, building them on
+        first use. Attack samples get ``attack/<instrument>`` as client id.
+
+        The samples are shallow copies of the cached ones, so that callers
+        may modify them (e.g. relabel their ``client_id``) without affecting
+        later calls."""
+        samples = self._samples.get(f.id)
+        if samples is None:
+            samples = tuple(File(f, i) for i in self.frame_indices(f))
+            if not f.is_real():
+                for sample in samples:
+                    sample.client_id = 'attack/{}'.format(f.instrument)
+            self._samples[f.id] = samples
+        return [copy.copy(sample) for sample in samples]